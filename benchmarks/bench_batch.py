@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""Benchmark of batched OR queries over a long tail of small domains.
+
+Run from the repository root with ``python benchmarks/bench_batch.py``.
+Every domain has only ``--hits`` results on the local server, so most of
+the SERPs a one-domain query pages through come back short or empty. Each
+batch size reports the SERP requests, hit page downloads, time, emails
+found and how many domains got exactly the emails of unbatched jobs.
+"""
+import logging
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from typing import Dict
+from typing import List
+
+sys.path.insert(0, '.')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import server  # noqa: E402
+from frisbee import Frisbee  # noqa: E402
+
+
+def run(jobs: List[Dict], batch_size: int, executor: str) -> Dict:
+    """Search the jobs in one run and total up the cost."""
+    frisbee = Frisbee(log_level=logging.ERROR, executor=executor,
+                      batch_size=batch_size)
+    start: float = time.time()
+    frisbee.search([dict(job) for job in jobs])
+    seconds: float = time.time() - start
+    results: List[Dict] = frisbee.get_results()
+    requests: int = sum(v for k, v in frisbee.metrics.counters.items()
+                        if k.startswith('status_'))
+    serps: int = frisbee.metrics.counters['serps']
+    return {'serps': serps, 'pages': requests - serps,
+            'seconds': seconds,
+            'emails': {j['domain']: sorted(j['results']['emails'])
+                       for j in results},
+            'batches': frisbee.metrics.counters['batches'],
+            'retries': frisbee.metrics.counters['batch_retries']}
+
+
+def main():
+    """Run the benchmark."""
+    parser = ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=200,
+                        help='Domains to search.')
+    parser.add_argument('--limit', type=int, default=50,
+                        help='Results to page through per query.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 4, 16],
+                        help='Batch sizes to compare.')
+    parser.add_argument('--executor', default='threads',
+                        choices=['threads', 'processes', 'hybrid'])
+    server.add_arguments(parser)
+    parser.set_defaults(hits=3, page_size=2000)
+    args = parser.parse_args()
+
+    process, host = server.start(server.options_from(args))
+    jobs: List[Dict] = [
+        {'engine': 'bing', 'modifier': None, 'limit': args.limit,
+         'domain': 'd%05d.example.com' % i, 'greedy': False, 'host': host,
+         'log_level': logging.ERROR}
+        for i in range(args.jobs)]
+    print("%-6s %6s %6s %8s %7s %7s %8s %7s" % (
+        'batch', 'serps', 'pages', 'seconds', 'emails', 'exact', 'batches',
+        'retries'))
+    baseline: Dict = dict()
+    for size in args.sizes:
+        totals: Dict = run(jobs, size, args.executor)
+        baseline = baseline or totals['emails']
+        exact: int = sum(totals['emails'].get(d) == e
+                         for d, e in baseline.items())
+        print("%-6d %6d %6d %8.2f %7d %7d %8d %7d" % (
+            size, totals['serps'], totals['pages'], totals['seconds'],
+            sum(len(e) for e in totals['emails'].values()), exact,
+            totals['batches'], totals['retries']))
+    process.terminate()
+
+
+if __name__ == '__main__':
+    main()
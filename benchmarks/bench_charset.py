@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""Benchmark of page decoding on a corpus of mixed encodings.
+
+Run from the repository root with ``python benchmarks/bench_charset.py``.
+Pages are written in several encodings, declared in the Content-Type
+header, in a <meta> tag or not at all, and carry emails whose local parts
+hold non-ASCII letters. Each path is timed and scored on how many pages
+give back exactly the emails that were written into them.
+"""
+import os
+import random
+import sys
+import timeit
+from argparse import ArgumentParser
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+sys.path.insert(0, '.')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import server  # noqa: E402
+from bs4 import BeautifulSoup  # noqa: E402
+from frisbee.utils import decode_html  # noqa: E402
+from frisbee.utils import extract_emails  # noqa: E402
+from frisbee.utils import html_to_text  # noqa: E402
+
+DOMAIN: str = 'd00001.example.com'
+#  Encoding, where it is declared and native words to build emails from
+VARIANTS: List[Tuple[str, str, List[str]]] = [
+    ('utf-8', 'header', ['zoë', 'müller', 'иван', '山田']),
+    ('utf-8', 'meta', ['françois', 'jürgen', 'ψαρι']),
+    ('utf-8', 'none', ['søren', 'łukasz', 'ñandú']),
+    ('cp1252', 'meta', ['zoë', 'müller', 'françois']),
+    ('cp1252', 'none', ['josé', 'bjørn', 'ångström']),
+    ('koi8-r', 'meta', ['иван', 'ольга', 'пётр']),
+    ('shift_jis', 'meta', ['山田', 'たなか', 'すずき']),
+    ('gb2312', 'header', ['王伟', '李娜', '张敏']),
+]
+
+try:
+    import charset_normalizer
+except ImportError:
+    charset_normalizer = None
+
+
+def build(size: int, pages: int) -> List[Tuple[str, bytes, str, List[str]]]:
+    """Write the corpus.
+
+    :returns: Variant name, body, Content-Type and the expected emails of
+    every page.
+    """
+    corpus: List[Tuple[str, bytes, str, List[str]]] = list()
+    for encoding, declared, natives in VARIANTS:
+        for index in range(pages):
+            rng: random.Random = random.Random('%s/%d' % (encoding, index))
+            words: List[str] = rng.choices(server._VOCABULARY,
+                                           k=max(size // 7, 1))
+            emails: List[str] = list()
+            for i in rng.sample(range(len(words)), 5):
+                email: str = '%s.%s@%s' % (rng.choice(natives),
+                                           words[i], DOMAIN)
+                words[i] = '%s %s' % (rng.choice(natives), email)
+                emails.append(email)
+            meta: str = ('<meta charset="%s">' % encoding
+                         if declared == 'meta' else '')
+            page: str = ('<html><head>%s<title>%s</title></head><body><p>%s'
+                         '</p></body></html>' % (meta, DOMAIN, ' '.join(words)))
+            content_type: str = 'text/html'
+            if declared == 'header':
+                content_type += '; charset=%s' % encoding
+            corpus.append(('%s/%s' % (encoding, declared),
+                           page.encode(encoding), content_type,
+                           sorted(set(e.lower() for e in emails))))
+    return corpus
+
+
+def paths() -> Dict[str, Callable[[bytes, str], str]]:
+    """Get the decoding paths to compare by name."""
+    calls: Dict[str, Callable[[bytes, str], str]] = {
+        'soup_latin1': lambda c, t: BeautifulSoup(
+            c, 'html.parser', from_encoding='iso-8859-1').get_text(),
+        'fast_latin1': lambda c, t: html_to_text(c, 'iso-8859-1'),
+        'soup_resolved': lambda c, t: BeautifulSoup(
+            decode_html(c, t)[0], 'html.parser').get_text(),
+        'fast_resolved': lambda c, t: html_to_text(decode_html(c, t)[0]),
+    }
+    if charset_normalizer:
+        #  What a requests response's text falls back on without a charset
+        calls['detect'] = lambda c, t: str(
+            charset_normalizer.from_bytes(c).best())
+    return calls
+
+
+def main():
+    """Run the benchmark."""
+    parser = ArgumentParser()
+    parser.add_argument('--page-size', type=int, default=20000,
+                        help='Approximate bytes of text per page.')
+    parser.add_argument('--pages', type=int, default=5,
+                        help='Pages per encoding variant.')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = build(args.page_size, args.pages)
+    variants: List[str] = list(dict.fromkeys(v for v, _, _, _ in corpus))
+    print("%-14s %10s  %s" % ('path', 'ms/page', 'exact pages per variant'))
+    for name, call in paths().items():
+        best: float = min(timeit.repeat(
+            lambda: [call(c, t) for _, c, t, _ in corpus],
+            number=1, repeat=args.repeat))
+        exact: Dict[str, int] = dict.fromkeys(variants, 0)
+        for variant, content, content_type, emails in corpus:
+            found: List[str] = extract_emails(call(content, content_type),
+                                              DOMAIN, False)
+            exact[variant] += sorted(found) == emails
+        print("%-14s %10.3f  %d/%d  %s" % (
+            name, best / len(corpus) * 1000, sum(exact.values()), len(corpus),
+            ' '.join('%s=%d' % item for item in exact.items())))
+
+
+if __name__ == '__main__':
+    main()
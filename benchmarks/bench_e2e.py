@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""End-to-end benchmark of `Frisbee.search` against the local server.
+
+Run from the repository root with ``python benchmarks/bench_e2e.py``. The
+synthetic server runs in its own process and every job points the bing
+module at it, so no real search engine is contacted.
+"""
+import logging
+import os
+import resource
+import sys
+import time
+from argparse import ArgumentParser
+from typing import Dict
+from typing import List
+
+sys.path.insert(0, '.')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import server  # noqa: E402
+from frisbee import Frisbee  # noqa: E402
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Get a percentile from a list of values by nearest rank."""
+    if not values:
+        return 0
+    ordered: List[float] = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def peak_rss() -> Dict[str, float]:
+    """Get the peak resident memory in MB of this process and its children."""
+    scale: int = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return {
+        'parent': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        'children': resource.getrusage(
+            resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    }
+
+
+def main():
+    """Run the benchmark."""
+    parser = ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=20,
+                        help='Domains to search.')
+    parser.add_argument('--limit', type=int, default=50,
+                        help='Results to page through per job.')
+    parser.add_argument('--executor', default='processes',
+                        choices=['threads', 'processes', 'hybrid'])
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--jobs-per-worker', type=int, default=16)
+    parser.add_argument('--backend', default='futures',
+                        choices=['futures', 'asyncio'])
+    parser.add_argument('--concurrency', type=int, default=None)
+    parser.add_argument('--extractor', default='soup',
+                        choices=['soup', 'fast'])
+    parser.add_argument('--pipeline', default=False, action='store_true')
+    parser.add_argument('--adaptive', default=False, action='store_true')
+    parser.add_argument('--dedup', default=False, action='store_true')
+    parser.add_argument('--timeout', type=float, default=7)
+    parser.add_argument('--retries', type=int, default=2)
+    parser.add_argument('--hedge', default=False, action='store_true')
+    parser.add_argument('--fixed-timeout', default=False, action='store_true')
+    server.add_arguments(parser)
+    args = parser.parse_args()
+
+    process, host = server.start(server.options_from(args))
+    logging.getLogger('frisbee.backends').setLevel(logging.ERROR)
+    jobs = [{'engine': 'bing', 'modifier': None, 'limit': args.limit,
+             'domain': 'd%05d.example.com' % i, 'greedy': False,
+             'host': host, 'backend': args.backend,
+             'concurrency': args.concurrency, 'extractor': args.extractor,
+             'pipeline': args.pipeline, 'adaptive': args.adaptive,
+             'timeout': args.timeout, 'retries': args.retries,
+             'hedge': args.hedge, 'adaptive_timeout': not args.fixed_timeout,
+             'log_level': logging.ERROR} for i in range(args.jobs)]
+    frisbee = Frisbee(log_level=logging.ERROR, executor=args.executor,
+                      workers=args.workers,
+                      jobs_per_worker=args.jobs_per_worker, dedup=args.dedup)
+    start: float = time.time()
+    frisbee.search(jobs)
+    elapsed: float = time.time() - start
+    process.terminate()
+
+    durations: List[float] = [float(j['duration'])
+                              for j in frisbee.get_results()]
+    emails: int = sum(len(j['results']['emails'])
+                      for j in frisbee.get_results())
+    pages: int = frisbee.metrics.counters['pages_parsed']
+    memory: Dict[str, float] = peak_rss()
+    print("Executor: %s, backend: %s, extractor: %s, pipeline: %s" %
+          (args.executor, args.backend, args.extractor, args.pipeline))
+    print("Jobs: %d in %.2fs (%.1f jobs/s)" %
+          (len(durations), elapsed, len(durations) / elapsed))
+    print("Pages: %d (%.1f pages/s), emails: %d" %
+          (pages, pages / elapsed, emails))
+    print("Job latency p50: %.3fs, p99: %.3fs" %
+          (percentile(durations, 0.5), percentile(durations, 0.99)))
+    print("Stage seconds: %s" % ', '.join(
+        '%s %.2f' % (k, v) for k, v in sorted(frisbee.metrics.stages.items())))
+    counters: Dict[str, int] = frisbee.metrics.counters
+    print("Retries: %d, hedges: %d (%d won), timeouts: %d, SERP 503s: %d" %
+          (counters['retries'], counters['hedges'], counters['hedge_wins'],
+           counters['timeouts'], counters['status_503']))
+    print("Peak RSS parent: %.1f MB, largest child: %.1f MB" %
+          (memory['parent'], memory['children']))
+
+
+if __name__ == '__main__':
+    main()
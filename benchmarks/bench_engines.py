@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""Benchmark of multi-engine jobs against one job per engine.
+
+Run from the repository root with ``python benchmarks/bench_engines.py``.
+A second engine, ``mirror``, is registered for the run. It queries the same
+local server as bing with its listings shifted by ``--overlap`` so the two
+engines share part of their result pages, like real engines do. Each mode
+reports the SERP requests, hit page downloads, time and emails found.
+"""
+import logging
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from collections import defaultdict
+from typing import Dict
+from typing import List
+from typing import Set
+
+sys.path.insert(0, '.')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import server  # noqa: E402
+from frisbee import Frisbee  # noqa: E402
+from frisbee.modules import register  # noqa: E402
+from frisbee.modules.bing import Module  # noqa: E402
+
+
+class Mirror(Module):
+
+    """Bing lookalike listing results a few positions further along."""
+
+    shift: int = 5
+
+    def _format(self) -> List[str]:
+        """Build SERP URLs offset from the ones bing would request."""
+        query: str = '"%s" %s' % (self.domain, self.modifier)
+        return ['%s/search?q=%s&first=%d' % (self.host, query, i + self.shift)
+                for i in range(0, self.limit, 10)]
+
+
+def run(jobs: List[Dict], executor: str) -> Dict[str, float]:
+    """Search the jobs in one run and total up the cost."""
+    frisbee = Frisbee(log_level=logging.ERROR, executor=executor)
+    start: float = time.time()
+    frisbee.search(jobs)
+    seconds: float = time.time() - start
+    results: List[Dict] = frisbee.get_results()
+    requests: int = sum(v for k, v in frisbee.metrics.counters.items()
+                        if k.startswith('status_'))
+    serps: int = sum(j['results']['pages'] for j in results)
+    emails: Dict[str, Set[str]] = defaultdict(set)
+    for job in results:
+        emails[job['domain']].update(job['results']['emails'])
+    return {'serps': serps, 'pages': requests - serps, 'seconds': seconds,
+            'emails': sum(len(found) for found in emails.values())}
+
+
+def main():
+    """Run the benchmark."""
+    parser = ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=10,
+                        help='Domains to search.')
+    parser.add_argument('--limit', type=int, default=50,
+                        help='Results to page through per engine.')
+    parser.add_argument('--overlap', type=int, default=5,
+                        help='Listing offset of the mirror engine, lower '
+                        'shares more pages with bing.')
+    parser.add_argument('--executor', default='threads',
+                        choices=['threads', 'processes', 'hybrid'])
+    server.add_arguments(parser)
+    args = parser.parse_args()
+
+    Mirror.shift = args.overlap
+    register('mirror', Mirror)
+    process, host = server.start(server.options_from(args))
+    domains: List[str] = ['d%05d.example.com' % i for i in range(args.jobs)]
+
+    def jobs(engine) -> List[Dict]:
+        return [{'engine': engine, 'modifier': None, 'limit': args.limit,
+                 'domain': d, 'greedy': False, 'host': host,
+                 'log_level': logging.ERROR} for d in domains]
+
+    modes: Dict[str, List[Dict]] = {
+        'bing only': jobs('bing'),
+        'one job per engine': jobs('bing') + jobs('mirror'),
+        'fan-out job': jobs(['bing', 'mirror']),
+    }
+    print("%-20s %6s %6s %8s %7s" % ('mode', 'serps', 'pages', 'seconds',
+                                     'emails'))
+    for name, batch in modes.items():
+        totals: Dict[str, float] = run(batch, args.executor)
+        print("%-20s %6d %6d %8.2f %7d" % (
+            name, totals['serps'], totals['pages'], totals['seconds'],
+            totals['emails']))
+    process.terminate()
+
+
+if __name__ == '__main__':
+    main()
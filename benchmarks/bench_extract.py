@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""Micro-benchmark email extraction against the original implementation.
+
+Run from the repository root with ``python benchmarks/bench_extract.py``.
+"""
+import random
+import string
+import sys
+import timeit
+from argparse import ArgumentParser
+from typing import List
+
+sys.path.insert(0, '.')
+from frisbee.utils import PATTERN  # noqa: E402
+from frisbee.utils import EmailMatcher  # noqa: E402
+from frisbee.utils import get_matcher  # noqa: E402
+
+
+def legacy_extract_emails(results: str, domain: str,
+                          fuzzy: bool) -> List[str]:
+    """Original single-domain extractor kept as the baseline."""
+    hits = list()
+    for match in PATTERN.finditer(results):
+        hits.append(tuple(match.groups())[0])
+    hits = list(set(hits))
+    if fuzzy:
+        seed = domain.split('.')[0]
+        emails = [x.lower().strip('.') for x in hits
+                  if x.split('@')[1].__contains__(seed)]
+    else:
+        emails = list()
+        for match in hits:
+            if domain not in match:
+                continue
+            match = match.lower()
+            emails.append(match[:match.find(domain) + len(domain)])
+    return emails
+
+
+def gen_text(size: int, domains: List[str], density: float) -> str:
+    """Build filler text with emails sprinkled through it."""
+    random.seed(size)
+    words: List[str] = list()
+    length: int = 0
+    while length < size:
+        if random.random() < density:
+            word = '%s@%s' % (''.join(random.sample(string.ascii_lowercase, 6)),
+                              random.choice(domains + ['noise.net']))
+        else:
+            word = ''.join(random.sample(string.ascii_lowercase,
+                                         random.randint(2, 10)))
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)
+
+
+def main():
+    """Run the comparison."""
+    parser = ArgumentParser()
+    parser.add_argument('--size', type=int, default=2000000,
+                        help='Characters of text to scan.')
+    parser.add_argument('--domains', type=int, default=50,
+                        help='Domains to match against.')
+    parser.add_argument('--density', type=float, default=0.01,
+                        help='Share of words that are emails.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--fuzzy', default=False, action='store_true')
+    args = parser.parse_args()
+
+    domains = ['d%03d.example.com' % i for i in range(args.domains)]
+    text = gen_text(args.size, domains, args.density)
+
+    legacy = {d: sorted(set(legacy_extract_emails(text, d, args.fuzzy)))
+              for d in domains}
+    matched = EmailMatcher(domains, args.fuzzy).match(text)
+    assert legacy == {d: sorted(e) for d, e in matched.items()}, \
+        "Matcher results differ from the original extractor"
+
+    def run_legacy():
+        for domain in domains:
+            legacy_extract_emails(text, domain, args.fuzzy)
+
+    def run_matcher():
+        get_matcher(tuple(domains), args.fuzzy).match(text)
+
+    old = min(timeit.repeat(run_legacy, number=1, repeat=args.repeat))
+    new = min(timeit.repeat(run_matcher, number=1, repeat=args.repeat))
+    print("Text: %d chars, domains: %d, fuzzy: %s" %
+          (len(text), len(domains), args.fuzzy))
+    print("legacy per-domain: %.3fs" % old)
+    print("single-pass matcher: %.3fs (%.1fx)" % (new, old / new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""Micro-benchmarks of the functions on a search's hot path.
+
+Run from the repository root with ``python benchmarks/bench_micro.py``.
+Content comes from the synthetic server's generators so results line up
+with the end-to-end benchmark. Pass ``--only`` to run a subset.
+
+Before timing, the fast extractor is checked against BeautifulSoup on a
+corpus of pages full of markup it has to get right: comments, scripts,
+styles, templates, CDATA, entities, quoted ``>`` in attributes and mailto
+links. Some pages only hold emails behind character references and some
+are encoded as UTF-16, so the raw-bytes pre-check is put to the test too.
+The texts must match and so must the emails, save for addresses that only
+appear in mailto links, which the fast path adds.
+"""
+import logging
+import os
+import random
+import sys
+import timeit
+from argparse import ArgumentParser
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Set
+from typing import Tuple
+
+sys.path.insert(0, '.')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import server  # noqa: E402
+from bs4 import BeautifulSoup  # noqa: E402
+from requests.structures import CaseInsensitiveDict  # noqa: E402
+from frisbee.backends import Response  # noqa: E402
+from frisbee.modules import get_module  # noqa: E402
+from frisbee.modules.bing import Module  # noqa: E402
+from frisbee.utils import clean_urls  # noqa: E402
+from frisbee.utils import decode_html  # noqa: E402
+from frisbee.utils import extract_emails  # noqa: E402
+from frisbee.utils import has_candidates  # noqa: E402
+from frisbee.utils import html_to_text  # noqa: E402
+
+DOMAIN: str = 'd00001.example.com'
+#  Fragments a checked page is built from, {e} is replaced by an email
+FRAGMENTS: List[str] = [
+    '{e}', 'mail {e}.', '<b>{e}</b>', '&lt;{e}&gt;', '{u}&#64;' + DOMAIN,
+    'caf&eacute; &amp; bar', '<!-- hidden {e} -->',
+    '<script>var a = "{e}"; if (a < b) {{}}</script>',
+    '<style>p > a {{ color: red; }}</style>',
+    '<template><p>{e}</p></template>', '<![CDATA[ kept {e} ]]>',
+    '<a href="/x?a>b" title=\'1 > 0\'>link</a>',
+    '<a href="mailto:{e}">write</a>', '<a href="mailto:{u}%40' + DOMAIN +
+    '?subject=hi">write</a>', '<br/>', '</p><p class="c">', '<img alt=">">',
+]
+#  Emails only visible once character references are decoded
+HIDDEN: List[str] = [
+    '{u}&#064;' + DOMAIN, '{u}&#x0040;' + DOMAIN, '{u}&#X40;' + DOMAIN,
+    '{u}&commat;' + DOMAIN, '{u}@' + DOMAIN.replace('.', '&#46;', 1),
+    '{u}@' + DOMAIN.replace('.', '&#x2E;'), '{u}@d00001.example&period;com',
+]
+
+
+def gen_checked_page(rng: random.Random, size: int) -> bytes:
+    """Build a page mixing filler words with tricky markup.
+
+    One page in ten holds no emails, one in four only hidden ones and one
+    in five is UTF-16.
+    """
+    kind: float = rng.random()
+    fragments: List[str] = [] if kind < 0.1 else \
+        HIDDEN if kind < 0.35 else FRAGMENTS
+    parts: List[str] = list()
+    for _ in range(size):
+        if not fragments or rng.random() < 0.7 or \
+                (fragments is HIDDEN and rng.random() < 0.9):
+            parts.append(rng.choice(server._VOCABULARY))
+            continue
+        user: str = rng.choice(server._VOCABULARY)
+        parts.append(rng.choice(fragments).format(
+            e='%s@%s' % (user, DOMAIN), u=user))
+    page: str = ('<!DOCTYPE html><html><head><title>t</title></head><body>'
+                 '<p>%s</p></body></html>' % ' '.join(parts))
+    return page.encode('utf-16' if rng.random() < 0.2 else 'utf-8')
+
+
+def check(pages: int, size: int) -> None:
+    """Compare the fast extractor with BeautifulSoup page by page."""
+    rng: random.Random = random.Random(pages)
+    same_text: int = 0
+    same_emails: int = 0
+    extras: int = 0
+    skipped: int = 0
+    for _ in range(pages):
+        page: bytes = gen_checked_page(rng, size)
+        soup: str = BeautifulSoup(decode_html(page)[0],
+                                  'html.parser').get_text()
+        fast: str = html_to_text(page)
+        #  The fast path appends mailto addresses after the page's text
+        same_text += fast == soup or fast.startswith(soup + ' ')
+        soup_emails: Set[str] = set(extract_emails(soup, DOMAIN, False))
+        fast_emails: Set[str] = set()
+        if has_candidates(page, DOMAIN):
+            fast_emails = set(extract_emails(fast, DOMAIN, False))
+        else:
+            skipped += 1
+        mailto: Set[str] = set(extract_emails(fast[len(soup):], DOMAIN,
+                                              False))
+        same_emails += soup_emails <= fast_emails and \
+            fast_emails - soup_emails <= mailto
+        extras += len(fast_emails - soup_emails)
+    print("fast vs soup: %d/%d pages same text, %d/%d same emails "
+          "(+%d mailto-only, %d skipped)" % (same_text, pages, same_emails,
+                                             pages, extras, skipped))
+    assert same_text == pages and same_emails == pages, \
+        "Fast extraction differs from BeautifulSoup"
+
+
+def build(args) -> Dict[str, Callable]:
+    """Prepare inputs and return the benchmarked calls by name."""
+    options: Dict = dict(server.DEFAULTS, **server.options_from(args))
+    settings: Tuple = tuple(sorted(options.items()))
+    domain: str = DOMAIN
+    headers = CaseInsensitiveDict({'Content-Type': 'text/html'})
+    serp: Response = Response(
+        'http://127.0.0.1/search', 200, headers,
+        server.gen_serp('http://127.0.0.1', (domain,), 0, settings))
+    page: bytes = server.gen_page(domain, 0, settings)
+    text: str = BeautifulSoup(page, 'html.parser').get_text()
+    urls: List[str] = ['http://127.0.0.1/page/%s/%d' % (domain, i)
+                       for i in range(args.limit)] * 2
+    module: Module = Module(domain=domain, limit=args.limit,
+                            log_level=logging.ERROR)
+    calls: Dict[str, Callable] = {
+        'serp_process': lambda: module._process([serp]),
+        'soup_text': lambda: BeautifulSoup(page, 'html.parser').get_text(),
+        'fast_text': lambda: html_to_text(page),
+        'extract_emails': lambda: extract_emails(text, domain, False),
+        'clean_urls': lambda: clean_urls(urls),
+        'dispatch': lambda: get_module('bing'),
+    }
+    if args.network:
+        _, host = server.start(options)
+        remote: List[str] = ['%s/page/%s/%d' % (host, domain, i)
+                             for i in range(args.limit)]
+        module.host = host
+        calls['request_bulk'] = lambda: module._request_bulk(remote)
+    return calls
+
+
+def main():
+    """Run the micro-benchmarks."""
+    parser = ArgumentParser()
+    parser.add_argument('--limit', type=int, default=50,
+                        help='URLs per bulk call.')
+    parser.add_argument('--number', type=int, default=20,
+                        help='Calls per timing.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', action='append', default=[],
+                        help='Benchmark to run, may be repeated.')
+    parser.add_argument('--network', default=False, action='store_true',
+                        help='Also time bulk requests to the local server.')
+    parser.add_argument('--check-pages', type=int, default=500,
+                        help='Pages to compare the fast extractor with '
+                        'BeautifulSoup on, 0 to skip.')
+    server.add_arguments(parser)
+    args = parser.parse_args()
+
+    logging.getLogger('frisbee.backends').setLevel(logging.ERROR)
+    if args.check_pages:
+        check(args.check_pages, 300)
+    calls: Dict[str, Callable] = build(args)
+    for name, call in calls.items():
+        if args.only and name not in args.only:
+            continue
+        best: float = min(timeit.repeat(call, number=args.number,
+                                        repeat=args.repeat))
+        print("%-16s %12.4f ms/call" % (name, best / args.number * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+"""Local stand-in for a search engine and the pages it links to.
+
+SERPs are served at ``/search`` with Bing-style ``li.b_algo`` listings and
+every listing links to a synthetic hit page under ``/page``. Page size,
+latency, error rate and email density are configurable and content is
+derived from the request path so repeated runs see the same pages. Slow
+tail responses and transient errors are drawn afresh on every request,
+so a retried or duplicated request can fare better than the first. A query
+OR-ing several quoted domains lists their hits interleaved, no deeper than
+a single domain's listings go, so large batches crowd domains out.
+
+Run standalone with ``python benchmarks/server.py --port 8000`` or start it
+from a benchmark through `start`.
+"""
+import functools
+import multiprocessing
+import random
+import string
+import sys
+import time
+import zlib
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Dict
+from typing import List
+from typing import Tuple
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+
+DEFAULTS: Dict = {'results': 10, 'serp_pages': 5, 'page_size': 20000,
+                  'latency': 0.0, 'jitter': 0.0, 'error_rate': 0.0,
+                  'density': 0.005, 'mailto': 0.2, 'tail': 0.0,
+                  'tail_latency': 2.0, 'flaky': 0.0, 'hits': 0}
+
+
+def _rng(path: str) -> random.Random:
+    """Get a generator seeded from a request path."""
+    return random.Random(zlib.crc32(path.encode('utf-8')))
+
+
+@functools.lru_cache(maxsize=4096)
+def gen_serp(base: str, domains: Tuple[str, ...], first: int,
+             settings: Tuple) -> bytes:
+    """Build a SERP listing hit pages for domains hosted under base."""
+    options: Dict = dict(settings)
+    depth: int = max(options['results'], 1) * options['serp_pages']
+    listed: List[Tuple[str, int]] = list()
+    if len(domains) == 1 and not options['hits']:
+        if first // max(options['results'], 1) < options['serp_pages']:
+            listed = [(domains[0], i)
+                      for i in range(first, first + options['results'])]
+    else:
+        ranked: List[Tuple[str, int]] = [
+            (domain, i) for i in range(options['hits'] or depth)
+            for domain in domains][:depth]
+        listed = ranked[first:first + options['results']]
+    items: List[str] = list()
+    for domain, i in listed:
+        items.append('<li class="b_algo"><h2><a href="%s/page/%s/%d">'
+                     'Result %d</a></h2><p>Snippet for %s</p></li>' %
+                     (base, domain, i, i, domain))
+    body: str = ('<html><head><title>%s - Search</title></head><body>'
+                 '<ol id="b_results">%s</ol></body></html>' %
+                 (' OR '.join(domains), ''.join(items)))
+    return body.encode('utf-8')
+
+
+_VOCABULARY: List[str] = [
+    ''.join(random.Random(i).sample(string.ascii_lowercase, 2 + i % 9))
+    for i in range(2000)
+]
+
+
+@functools.lru_cache(maxsize=4096)
+def gen_page(domain: str, index: int, settings: Tuple) -> bytes:
+    """Build a hit page of filler text with emails sprinkled through it."""
+    options: Dict = dict(settings)
+    rng: random.Random = _rng('%s/%d' % (domain, index))
+    hosts: List[str] = [domain, 'mail.' + domain, 'noise.net', 'example.org']
+    count: int = max(options['page_size'] // 7, 1)
+    words: List[str] = rng.choices(_VOCABULARY, k=count)
+    for i in rng.sample(range(count), int(count * options['density'])):
+        email: str = '%s@%s' % (rng.choice(_VOCABULARY),
+                                rng.choice(hosts))
+        if rng.random() < options['mailto']:
+            email = '<a href="mailto:%s">contact</a>' % email
+        words[i] = email
+    for i in range(0, count, 40):
+        words[i] = '</p><p class="c%d">%s' % (i % 10, words[i])
+    body: str = ('<html><head><title>%s</title><script>var x = 1;</script>'
+                 '</head><body><p>%s</p></body></html>' %
+                 (domain, ' '.join(words)))
+    return body.encode('utf-8')
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    """Serve synthetic SERPs and hit pages."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self) -> None:
+        """Answer a request for a SERP or a hit page."""
+        options: Dict = self.server.options
+        rng: random.Random = _rng(self.path)
+        delay: float = options['latency'] + rng.random() * options['jitter']
+        if random.random() < options['tail']:
+            delay += options['tail_latency']
+        if delay:
+            time.sleep(delay)
+        if rng.random() < options['error_rate']:
+            return self._send(500, b'error')
+        if random.random() < options['flaky']:
+            return self._send(503, b'try again')
+        settings: Tuple = tuple(sorted(options.items()))
+        parts = urlsplit(self.path)
+        if parts.path == '/search':
+            query: Dict = parse_qs(parts.query)
+            terms: str = query.get('q', [''])[0]
+            domains: Tuple[str, ...] = tuple(terms.split('"')[1::2]) \
+                if terms.count('"') > 1 else ('unknown',)
+            first: int = int(query.get('first', ['0'])[0])
+            base: str = 'http://%s' % self.headers.get('Host', '127.0.0.1')
+            return self._send(200, gen_serp(base, domains, first, settings))
+        if parts.path.startswith('/page/'):
+            _, _, domain, index = parts.path.split('/', 3)
+            return self._send(200, gen_page(domain, int(index), settings))
+        return self._send(404, b'not found')
+
+    def _send(self, status: int, body: bytes) -> None:
+        """Write a complete HTML response."""
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        """Keep request logging quiet."""
+        pass
+
+
+class Server(ThreadingHTTPServer):
+
+    """Threaded server carrying the synthetic content options."""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address: Tuple[str, int], options: Dict) -> None:
+        """Bind the server with its options."""
+        super(Server, self).__init__(address, Handler)
+        self.options: Dict = dict(DEFAULTS, **options)
+
+    def handle_error(self, request, client_address) -> None:
+        """Ignore clients hanging up early, as timed out requests do."""
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super(Server, self).handle_error(request, client_address)
+
+
+def _serve(options: Dict, port: int, ready) -> None:
+    """Run the server, reporting the bound port once listening."""
+    server: Server = Server(('127.0.0.1', port), options)
+    ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start(options: Dict, port: int = 0) -> Tuple[multiprocessing.Process, str]:
+    """Start the server in its own process.
+
+    :returns: The server process and the host URL to point modules at.
+    """
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, daemon=True,
+                                      args=(options, port, ready))
+    process.start()
+    return process, 'http://127.0.0.1:%d' % ready.get(timeout=10)
+
+
+def add_arguments(parser: ArgumentParser) -> None:
+    """Add the content options to a benchmark's argument parser."""
+    parser.add_argument('--results', type=int, default=DEFAULTS['results'],
+                        help='Listings per SERP.')
+    parser.add_argument('--serp-pages', type=int,
+                        default=DEFAULTS['serp_pages'],
+                        help='SERPs with listings before results run dry.')
+    parser.add_argument('--page-size', type=int,
+                        default=DEFAULTS['page_size'],
+                        help='Approximate bytes of text per hit page.')
+    parser.add_argument('--latency', type=float, default=DEFAULTS['latency'],
+                        help='Seconds added to every response.')
+    parser.add_argument('--jitter', type=float, default=DEFAULTS['jitter'],
+                        help='Random extra seconds up to this much.')
+    parser.add_argument('--error-rate', type=float,
+                        default=DEFAULTS['error_rate'],
+                        help='Share of requests answered with a 500.')
+    parser.add_argument('--density', type=float, default=DEFAULTS['density'],
+                        help='Share of words on a page that are emails.')
+    parser.add_argument('--tail', type=float, default=DEFAULTS['tail'],
+                        help='Share of requests, drawn per request, that are '
+                        'slowed by the tail latency.')
+    parser.add_argument('--tail-latency', type=float,
+                        default=DEFAULTS['tail_latency'],
+                        help='Seconds added to tail requests.')
+    parser.add_argument('--flaky', type=float, default=DEFAULTS['flaky'],
+                        help='Share of requests, drawn per request, answered '
+                        'with a transient 503.')
+    parser.add_argument('--hits', type=int, default=DEFAULTS['hits'],
+                        help='Results each domain has, 0 for as many as the '
+                        'SERP pages hold.')
+
+
+def options_from(args) -> Dict:
+    """Collect the content options from parsed arguments."""
+    return {'results': args.results, 'serp_pages': args.serp_pages,
+            'page_size': args.page_size, 'latency': args.latency,
+            'jitter': args.jitter, 'error_rate': args.error_rate,
+            'density': args.density, 'tail': args.tail,
+            'tail_latency': args.tail_latency, 'flaky': args.flaky,
+            'hits': args.hits}
+
+
+def main():
+    """Serve until interrupted."""
+    parser = ArgumentParser()
+    parser.add_argument('--port', type=int, default=8000)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server: Server = Server(('127.0.0.1', args.port), options_from(args))
+    print("Serving on http://127.0.0.1:%d" % server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
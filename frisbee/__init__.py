@@ -1,41 +1,83 @@
 #!/usr/bin/env python
 import copy
+import heapq
+import itertools
 import json
 import logging
+import multiprocessing
 import os
 import random
-from importlib import import_module
+import time
+from typing import Callable
 from typing import ClassVar
 from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
-import namesgenerator
+from typing import Optional
+from typing import Tuple
+from frisbee import dedup
+from frisbee import limiter
+from frisbee import logs
+from frisbee.dedup import KeySet
+from frisbee.dedup import PageRegistry
+from frisbee.executors import EXECUTORS
+from frisbee.executors import JOBS_PER_WORKER
+from frisbee.executors import get_executor
+from frisbee.journal import Journal
+from frisbee.limiter import RateLimiter
+from frisbee.metrics import Metrics
+from frisbee.modules import get_module
+from frisbee.sinks import SINKS
+from frisbee.sinks import Sink
+from frisbee.sinks import get_sink
 from frisbee.utils import gen_logger
 from frisbee.utils import str_datetime
 from frisbee.utils import now_time
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import wait
 
 
 os.environ['OBJC_DISABLE_INITIALIZE_FORK_SAFETY'] = 'YES'
+LOG: logging.Logger = gen_logger('jobs')
+#  Options carried over from a job to the greedy jobs it spawns
+JOB_OPTIONS: List[str] = ['backend', 'concurrency', 'timeout', 'pool',
+                          'max_bytes', 'pipeline', 'queue_size', 'adaptive',
+                          'wave', 'extractor', 'cache', 'cache_ttl',
+                          'cache_max_bytes', 'host', 'retries', 'hedge',
+                          'adaptive_timeout']
+#  Keys a job gains once it has run, left out of its identity
+RUN_KEYS: List[str] = ['start_time', 'end_time', 'duration', 'results',
+                       'project']
+#  Share of a job's `limit` under which a batch's listings count as sparse
+SPARSE: float = 0.3
 
 
 def dyn_loader(module: str, kwargs: str):
     """Dynamically load a specific module instance.
 
-    The purpose of this function is to peek into the modules directory and
-    load up the parsing module the user has specified. The benefit this brings
-    is that we have no hardcoding for any module identification. Drop it into
-    the folder and it's callable.
+    Modules are found by name in the modules directory or among the engines
+    other packages register under the `frisbee.modules` entry point group,
+    so there is no hardcoding for any module identification. Drop it into
+    the folder and it's callable. Lookups are cached for the process.
     """
-    package_directory: str = os.path.dirname(os.path.abspath(__file__))
-    modules: str = package_directory + "/modules"
-    module = module + ".py"
-    if module not in os.listdir(modules):
-        raise Exception("Module %s is not valid" % module)
-    module_name: str = module[:-3]
-    import_path: str = "%s.%s" % ('frisbee.modules', module_name)
-    imported = import_module(import_path)
-    obj = getattr(imported, 'Module')
-    return obj(**kwargs)
+    return get_module(module)(**kwargs)
+
+
+def random_name() -> str:
+    """Name a project, loading the name generator only when needed."""
+    import namesgenerator
+    return namesgenerator.get_random_name()
+
+
+def _init_worker(rate_limiter: Optional[RateLimiter],
+                 registry: Optional[PageRegistry], log_queue=None,
+                 log_level: Optional[int] = None) -> None:
+    """Install state shared by the whole run inside a worker process."""
+    limiter.install(rate_limiter)
+    dedup.install(registry)
+    logs.install(log_queue, log_level)
 
 
 def collect(job):
@@ -43,14 +85,26 @@ def collect(job):
 
     Ideally this would be part of the Frisbee class, but futures are not a fan
     of referencing self and prefer to have their targets outside of the class
-    space.
+    space. A job may name a list of engines, they then share the fetching
+    of result pages and the emails are attributed to each engine. A job may
+    also carry a list of `domains` to search at once, see `Frisbee.search`.
     """
-    print("Job: %s" % str(job))
-    engine = dyn_loader(job['engine'], job)
+    engines: List[str] = job['engine'] if isinstance(job['engine'], list) \
+        else [job['engine']]
+    LOG.info("Job: %s (%s)", ', '.join(job.get('domains') or [job['domain']]),
+             ', '.join(engines))
+    modules: Dict = {name: dyn_loader(name, dict(job, engine=name))
+                     for name in engines}
     job['start_time'] = now_time()
-    results = engine.search()
+    if len(modules) > 1:
+        from frisbee.modules.base import fan_out
+        results = fan_out(modules)
+    else:
+        results = modules[engines[0]].search()
+        results.setdefault('engines', {engines[0]: results['emails']})
     job['end_time'] = now_time()
-    duration: str = str((job['end_time'] - job['start_time']).seconds)
+    duration: str = str(round(
+        (job['end_time'] - job['start_time']).total_seconds(), 3))
     job['duration'] = duration
     job.update({'results': results})
     return job
@@ -62,27 +116,69 @@ class Frisbee:
 
     NAME: ClassVar[str] = "Frisbee"
 
-    def __init__(self, project: str = namesgenerator.get_random_name(),
-                 log_level: int = logging.INFO, save: bool = False):
+    def __init__(self, project: Optional[str] = None,
+                 log_level: int = logging.INFO, save: bool = False,
+                 log_format: str = 'text',
+                 rate_limiter: Optional[RateLimiter] = None,
+                 dedup: bool = False, max_depth: int = 1,
+                 max_domains: int = 0, executor: str = 'processes',
+                 workers: Optional[int] = None,
+                 jobs_per_worker: int = JOBS_PER_WORKER,
+                 sink: str = 'files', resume: bool = False,
+                 metrics_json: Optional[str] = None,
+                 metrics_prom: Optional[str] = None,
+                 keep_results: bool = True, batch_size: int = 1):
         """Creation. The moons and the planets are there."""
-        self.project: str = project
-        self.project += "_%d" % (random.randint(100000, 999999))
-        self._log: logging.Logger = gen_logger(self.NAME, log_level)
-        self.output: bool = save
+        self.project: str = project or random_name()
+        self.rate_limiter: Optional[RateLimiter] = rate_limiter
+        self.dedup: bool = dedup
+        self.max_depth: int = max_depth
+        self.max_domains: int = max_domains
+        if executor not in EXECUTORS:
+            raise Exception("Executor %s is not valid" % executor)
+        self.executor: str = executor
+        self.workers: Optional[int] = workers
+        self.jobs_per_worker: int = jobs_per_worker
+        if not resume:
+            self.project += "_%d" % (random.randint(100000, 999999))
+        logs.setup(log_format, log_level)
+        self._log: logging.Logger = gen_logger(self.NAME)
+        self.output: bool = save or resume
+        self.resume: bool = resume
         self.folder: str = os.getcwd()
+        if sink not in SINKS:
+            raise Exception("Sink %s is not valid" % sink)
+        self.sink_name: str = sink
+        self.sink: Optional[Sink] = None
+        self.journal: Optional[Journal] = None
+        self.metrics_json: Optional[str] = metrics_json
+        self.metrics_prom: Optional[str] = metrics_prom
+        self.keep_results: bool = keep_results
+        if batch_size < 1:
+            raise Exception("Batch size must be at least 1")
+        self.batch_size: int = batch_size
+        self._batch: int = batch_size
         self._config_bootstrap()
 
-        self._processed: List = list()
+        self._seen: KeySet = KeySet()
+        self._inputs: KeySet = KeySet()
+        self._finished: KeySet = KeySet()
+        self._capped: bool = False
+        self._unsaved: List[str] = list()
 
         self.results: List = list()
-        self.saved: List = list()
+        self.metrics: Metrics = Metrics()
 
     def _reset(self) -> None:
         """Reset some of the state in the class for multi-searches."""
-        self.project: str = namesgenerator.get_random_name()
+        self.project: str = random_name()
         self.project += "_%d" % (random.randint(100000, 999999))
-        self._processed: List = list()
+        self._seen: KeySet = KeySet()
         self.results: List = list()
+        self.metrics: Metrics = Metrics()
+        if self.journal:
+            self.journal.close()
+            self.journal = Journal(self.folder + "/journals", self.project)
 
     def _config_bootstrap(self) -> None:
         """Handle the basic setup of the tool prior to user control.
@@ -92,79 +188,382 @@ class Frisbee:
         """
         if self.output:
             self.folder: str = os.getcwd() + "/results"
-            if not os.path.exists(self.folder):
-                os.mkdir(self.folder)
-            self.folder += "/" + self.project
-            os.mkdir(self.folder)
+            self.sink = get_sink(self.sink_name, self.folder)
+            self.journal = Journal(self.folder + "/journals", self.project)
+            if self.resume and not self.journal.exists():
+                raise Exception("No journal found for project %s" %
+                                self.project)
+            self._log.info("Saving results to '%s' as %s" %
+                           (self.folder, self.sink_name))
 
     def _progressive_save(self, job) -> None:
-        """Save output to a dictionary as results stream in.
+        """Save output to the sink as results stream in.
 
         Depending on the options used, Frisbee can run for quite a long time.
-        Each individual job is written after its completed and includes the
-        findings along with the job details.
+        Each individual job is handed over after its completed and includes
+        the findings along with the job details.
         """
-        self._log.info("Saving results to '%s'" % self.folder)
-        path: str = self.folder + "/"
-        if job['domain'] in self.saved:
-            return
         job['start_time'] = str_datetime(job['start_time'])
         job['end_time'] = str_datetime(job['end_time'])
-        jid: int = random.randint(100000, 999999)
-        filename: str = "%s_%s_%d_job.json" % (self.project, job['domain'], jid)
-        handle = open(path + filename, 'w')
-        handle.write(json.dumps(job, indent=4))
-        handle.close()
-
-        filename = "%s_%s_%d_emails.txt" % (self.project, job['domain'], jid)
-        handle = open(path + filename, 'w')
-        for email in job['results']['emails']:
-            handle.write(email + "\n")
-        handle.close()
-        self.saved.append(job['domain'])
-
-    def search(self, jobs: List[Dict[str, str]], executor=None) -> None:
-        """Perform searches based on job orders."""
-        if not isinstance(jobs, list):
-            raise Exception("Jobs must be of type list.")
+        if not self.sink:
+            return
+        self.sink.write(job)
+        self._unsaved.append(job['domain'])
+        if not self.sink.buffered:
+            self._checkpoint()
+
+    def _settle(self) -> None:
+        """Write out buffered jobs and mark them done in the journal.
+
+        Runs after each finished job while a journal is kept, so a crash
+        only costs the jobs still in flight. The sink's buffer then only
+        groups the outputs of a batch into one write.
+        """
+        if self.sink and self.journal and self.sink.buffered:
+            self.sink.flush()
+            self._checkpoint()
+
+    def _checkpoint(self) -> None:
+        """Mark jobs done in the journal once the sink has written them."""
+        if self.journal:
+            for domain in self._unsaved:
+                self.journal.done(domain)
+        self._unsaved = list()
+
+    def _key(self, domain: str) -> str:
+        """Get the key of a domain, whatever its case."""
+        return domain.lower()
+
+    def _identity(self, job: Dict) -> str:
+        """Get the key of a job order: its domain, engine and options."""
+        order: Dict = {k: v for k, v in job.items() if k not in RUN_KEYS}
+        order['domain'] = job['domain'].lower()
+        return json.dumps(order, sort_keys=True, default=str)
+
+    def _claim(self, domain: str) -> bool:
+        """Mark a domain as seen, returning False if it already was."""
+        return self._seen.add(self._key(domain))
+
+    def _admit(self, job: Dict) -> bool:
+        """Check whether an input job should run.
+
+        Repeats of the same order, jobs for domains a resumed project
+        already finished and new domains past `max_domains` are skipped.
+        The domain is marked as seen so greedy jobs don't search it again,
+        but a domain greedy jobs found first still runs as its own input
+        job.
+        """
+        key: str = self._identity(job)
+        domain: str = self._key(job['domain'])
+        if key in self._inputs or domain in self._finished:
+            return False
+        if self.max_domains and domain not in self._seen and \
+                len(self._seen) >= self.max_domains:
+            if not self._capped:
+                self._log.info("Domain limit reached: %d" % self.max_domains)
+                self._capped = True
+            return False
+        self._inputs.add(key)
+        self._claim(job['domain'])
+        return True
+
+    def _recover(self) -> List[Tuple[int, Dict]]:
+        """Mark finished domains as seen and bring back unfinished jobs.
+
+        :returns: Unfinished jobs from the journal along with their depth.
+        """
+        if not self.resume or not self.journal:
+            return list()
+        finished, unfinished = self.journal.replay()
+        for domain in finished:
+            self._claim(domain)
+            self._finished.add(self._key(domain))
+        self._log.info("Resuming project: %d done, %d requeued" %
+                       (len(finished), len(unfinished)))
+        return list(unfinished.values())
+
+    def _bonus_jobs(self, output: Dict) -> List[Dict]:
+        """Build jobs for unseen domains found in a greedy job's results."""
+        bonus_jobs: List[Dict] = list()
+        for item in output['results']['emails']:
+            part_split = item.split('@')
+            if len(part_split) == 1:
+                continue
+            found: str = part_split[1]
+            if self._key(found) in self._seen:
+                continue
+            if self.max_domains and len(self._seen) >= self.max_domains:
+                self._log.info("Domain limit reached: %d" % self.max_domains)
+                break
+            self._claim(found)
+            base: Dict = dict()
+            base['limit'] = output['limit']
+            base['modifier'] = output['modifier']
+            base['engine'] = output['engine']
+            base['greedy'] = False
+            base['domain'] = found
+            for key in JOB_OPTIONS:
+                if key in output:
+                    base[key] = output[key]
+            bonus_jobs.append(base)
+        return bonus_jobs
+
+    def _take(self, queue: List[Tuple[int, int, Dict]],
+              intake: Iterator[Dict],
+              carry: List[Tuple[int, Dict]]) -> Optional[Tuple[int, Dict]]:
+        """Get the next job to run along with its depth.
+
+        A job held back from the last batch comes first, then queued greedy
+        jobs, then unseen domains from the input.
+        """
+        if carry:
+            return carry.pop()
+        if queue:
+            depth, _, job = heapq.heappop(queue)
+            return depth, job
+        for job in intake:
+            if self._admit(job):
+                return 0, job
+        return None
+
+    def _gather(self, queue: List[Tuple[int, int, Dict]],
+                intake: Iterator[Dict], carry: List[Tuple[int, Dict]],
+                caps: Dict[int, int]) -> Optional[Tuple[int, List[Dict]]]:
+        """Take the next job along with those it can be batched with.
+
+        The first job that can't join is held back in `carry` for the next
+        batch. Jobs handed back from a full batch carry a cap in `caps` on
+        the size of the batches they may join again.
+
+        :returns: The depth and jobs of the batch, None once out of jobs.
+        """
+        item = self._take(queue, intake, carry)
+        if item is None:
+            return None
+        depth, job = item
+        batch: List[Dict] = [job]
+        size: int = min(self._batch, caps.get(id(job), self._batch))
+        while len(batch) < size:
+            item = self._take(queue, intake, carry)
+            if item is None:
+                break
+            if item[0] != depth or caps.get(id(item[1]), size) < size or \
+                    not self._batchable(job, item[1]):
+                carry.append(item)
+                break
+            batch.append(item[1])
+        return depth, batch
+
+    def _batchable(self, job: Dict, other: Dict) -> bool:
+        """Check whether two jobs may be searched with one query."""
+        if not isinstance(job['engine'], str) or \
+                not get_module(job['engine']).batchable:
+            return False
+        return dict(job, domain=None) == dict(other, domain=None)
+
+    def _resize(self, output: Dict, batch: List[Dict]) -> List[Dict]:
+        """Adapt the batch size to how many results the last query listed.
+
+        Sparse listings allow twice the batch's size, up to `batch_size`.
+        Listings that reach the job's limit allow half of it, as the engine
+        may have cut some domains short, and the whole batch is handed back
+        to be searched again in smaller batches. Sizes follow the batch
+        that finished rather than the current size, so batches sent before
+        a change don't compound it.
+
+        :returns: Jobs of the batch to search again.
+        """
+        counters: Dict = output['results'].get('metrics', dict()).get(
+            'counters', dict())
+        links: int = counters.get('serp_links', 0)
+        if links < SPARSE * output['limit']:
+            self._batch = max(self._batch, min(len(batch) * 2,
+                                               self.batch_size))
+            return list()
+        if links < output['limit']:
+            return list()
+        self._batch = min(self._batch, max(len(batch) // 2, 1))
+        return batch if len(batch) > 1 else list()
+
+    def _demux(self, output: Dict, batch: List[Dict]) -> List[Dict]:
+        """Split the output of a batched job into one output per domain.
+
+        Domains keep the timings, SERP and page counts of the batch they
+        were searched in, named under `batch`. The batch's metrics are
+        merged here once rather than with each of its domains.
+        """
+        if 'domains' not in output['results']:
+            return [output]
+        results: Dict = output['results']
+        self.metrics.merge(results.get('metrics', dict()))
+        self.metrics.counters['batches'] += 1
+        domains: List[str] = [job['domain'] for job in batch]
+        outputs: List[Dict] = list()
+        for job in batch:
+            emails: List[str] = results['domains'].get(job['domain'], list())
+            for key in ['start_time', 'end_time', 'duration']:
+                job[key] = output[key]
+            job['results'] = {'emails': emails,
+                              'engines': {job['engine']: emails},
+                              'processed': results['processed'],
+                              'pages': results['pages'], 'batch': domains}
+            outputs.append(job)
+        return outputs
+
+    def search(self, jobs: Iterable[Dict[str, str]], executor=None,
+               callback: Optional[Callable[[Dict], None]] = None) -> None:
+        """Perform searches based on job orders.
+
+        Jobs may be any iterable and are only read as there is room for
+        them, at most twice the executor's capacity are in flight at once
+        and repeated job orders are skipped. Greedy jobs are queued as soon as
+        their parent finishes, ordered by depth, and are greedy themselves
+        until `max_depth` is reached. Queued greedy jobs go ahead of new
+        input so the queue stays small however long the input is.
+
+        With `batch_size` above 1, consecutive jobs that only differ in
+        their domain are searched with a single OR query on engines that
+        support it, and the emails are split back into one output per
+        domain. The size adapts to how full the listings come back.
+
+        Each finished job is passed to `callback` as soon as it is saved.
+        With `keep_results` off jobs are not kept once handed over.
+        """
         self._log.info("Project: %s" % self.project)
-        self._log.info("Processing jobs: %d", len(jobs))
-
-        if not executor:
-            #  Reuse the same executor pool when processing greedy jobs
-            executor = ProcessPoolExecutor()
-
-        futures = [executor.submit(collect, job) for job in jobs]
-        for future in as_completed(futures):
-            output = future.result()
-            output.update({'project': self.project})
-            self._processed.append(output['domain'])
-            self.results.append(output)
-            self._progressive_save(output)
-
-            if output['greedy']:
-                bonus_jobs: List = list()
-                observed: List = list()
-                for item in output['results']['emails']:
-                    part_split = item.split('@')
-                    if len(part_split) == 1:
-                        continue
-                    found: str = item.split('@')[1]
-                    if found in self._processed or found in observed:
-                        continue
-                    observed.append(found)
-                    base: Dict = dict()
-                    base['limit'] = output['limit']
-                    base['modifier'] = output['modifier']
-                    base['engine'] = output['engine']
-                    base['greedy'] = False
-                    base['domain'] = found
-                    bonus_jobs.append(base)
-
-                if bonus_jobs:
-                    self.search(bonus_jobs, executor=executor)
+        if isinstance(jobs, list):
+            self._log.info("Processing jobs: %d", len(jobs))
+
+        manager = None
+        listener = None
+        started: float = time.time()
+        owned: bool = executor is None
+        pending: Dict[Future, Tuple[int, List[Dict]]] = dict()
+        if self.output and not self.sink:
+            self.sink = get_sink(self.sink_name, self.folder)
+        failed: bool = True
+        try:
+            if owned:
+                registry: Optional[PageRegistry] = None
+                if self.dedup:
+                    manager = multiprocessing.Manager()
+                    registry = PageRegistry(manager)
+                limiter.install(self.rate_limiter)
+                dedup.install(registry)
+                log_queue = None
+                if self.executor != 'threads':
+                    #  Workers hand records to a single writer in this process
+                    log_queue = multiprocessing.Queue()
+                    listener = logs.listen(log_queue)
+                executor, capacity = get_executor(
+                    self.executor, self.workers, self.jobs_per_worker,
+                    initializer=_init_worker,
+                    initargs=(self.rate_limiter, registry, log_queue,
+                              logging.getLogger(logs.ROOT).level))
+            else:
+                capacity = self.workers or os.cpu_count() or 1
 
+            self._seen = KeySet()
+            self._inputs = KeySet()
+            self._finished = KeySet()
+            self._capped = False
+            queue: List[Tuple[int, int, Dict]] = list()
+            counter = itertools.count()
+            if owned:
+                for depth, job in self._recover():
+                    self._claim(job['domain'])
+                    if not depth:
+                        self._inputs.add(self._identity(job))
+                    heapq.heappush(queue, (depth, next(counter), job))
+            intake: Iterator[Dict] = iter(jobs)
+            carry: List[Tuple[int, Dict]] = list()
+            #  Largest batch a job handed back from a full one may join again
+            caps: Dict[int, int] = dict()
+            self._batch = self.batch_size
+            while True:
+                while len(pending) < capacity * 2:
+                    gathered = self._gather(queue, intake, carry, caps)
+                    if gathered is None:
+                        break
+                    depth, batch = gathered
+                    job = batch[0]
+                    if self.journal:
+                        for member in batch:
+                            self.journal.started(member, depth)
+                    if len(batch) > 1:
+                        job = dict(job, domains=[m['domain'] for m in batch])
+                    pending[executor.submit(collect, job)] = (depth, batch)
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    depth, batch = pending.pop(future)
+                    output = future.result()
+                    for job in batch:
+                        caps.pop(id(job), None)
+                    retry: List[Dict] = self._resize(output, batch) \
+                        if self.batch_size > 1 else list()
+                    for job in retry:
+                        self.metrics.counters['batch_retries'] += 1
+                        caps[id(job)] = len(retry) // 2
+                        heapq.heappush(queue, (depth, next(counter), job))
+                    batch = [job for job in batch if job not in retry]
+                    for output in self._demux(output, batch):
+                        output.update({'project': self.project})
+                        if self.keep_results:
+                            self.results.append(output)
+                        self.metrics.merge(output['results'].get('metrics',
+                                                                 dict()))
+                        self.metrics.counters['jobs'] += 1
+                        self._progressive_save(output)
+                        if callback:
+                            callback(output)
+
+                        if not output['greedy'] or depth >= self.max_depth:
+                            continue
+                        for job in self._bonus_jobs(output):
+                            job['greedy'] = depth + 1 < self.max_depth
+                            if self.journal:
+                                self.journal.queued(job, depth + 1)
+                            heapq.heappush(queue, (depth + 1, next(counter),
+                                                   job))
+                    self._settle()
             self._log.info("All jobs processed")
+            self.metrics.stages['run'] += time.time() - started
+            self._report()
+            failed = False
+        finally:
+            #  Release everything and keep what finished, even on errors
+            if manager:
+                self._log.info("Fetches avoided by deduplication: %d" %
+                               self.metrics.counters['dedup_avoided'])
+                dedup.install(None)
+                manager.shutdown()
+            if owned and executor:
+                for future in pending:
+                    future.cancel()
+                executor.shutdown(wait=not failed)
+            if listener:
+                listener.stop()
+            if self.sink:
+                self.sink.close()
+                self.sink = None
+                self._checkpoint()
+            if self.journal:
+                self.journal.close()
+
+    def _report(self) -> None:
+        """Log the run metrics and export them where requested."""
+        self._log.info("Pages parsed: %d (%.1f/s), latency p50 %s p99 %s" %
+                       (self.metrics.counters['pages_parsed'],
+                        self.metrics.pages_per_second(),
+                        self.metrics.describe(0.5),
+                        self.metrics.describe(0.99)))
+        if self.metrics_json:
+            with open(self.metrics_json, 'w') as handle:
+                handle.write(self.metrics.to_json())
+        if self.metrics_prom:
+            with open(self.metrics_prom, 'w') as handle:
+                handle.write(self.metrics.to_prometheus())
 
     def get_results(self) -> List:
         """Return results from the search."""
@@ -0,0 +1,481 @@
+#!/usr/bin/env python
+import asyncio
+import atexit
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib.parse import urlparse
+from frisbee.limiter import RateLimiter
+from frisbee.utils import decode_html
+from frisbee.utils import gen_headers
+from frisbee.utils import gen_logger
+from typing import Any
+from typing import Callable
+from typing import ClassVar
+from typing import Deque
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+
+LOG: logging.Logger = gen_logger('backends')
+CHUNK_SIZE: int = 65536
+MAX_BYTES: int = 3000000
+TEXT_TYPES: List[str] = ['text/', 'application/xhtml', 'application/xml',
+                         'application/json', 'application/rss',
+                         'application/atom']
+POOL_DEFAULTS: Dict[str, Any] = {'size': 100, 'per_host': None, 'idle': 30,
+                                 'hosts': {}}
+
+
+class Response(object):
+
+    """Minimal response object mirroring the parts of requests we rely on."""
+
+    def __init__(self, url: str, status_code: int, headers: Dict[str, str],
+                 content: bytes, encoding: Optional[str] = None) -> None:
+        """Hold the response details."""
+        self.url: str = url
+        self.status_code: int = status_code
+        self.headers: Dict[str, str] = headers
+        self.content: bytes = content
+        self.encoding: Optional[str] = encoding
+        self.rejected: Optional[str] = None
+        self.saved: int = 0
+        self.cached: bool = False
+        self.request_url: str = url
+        self.elapsed: float = 0
+        self._text: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        """Decode the content once, resolving and keeping its encoding."""
+        if self._text is None:
+            self._text, self.encoding = decode_html(
+                self.content, self.headers.get('Content-Type', ''),
+                self.encoding)
+        return self._text
+
+    def release(self) -> None:
+        """Drop the decoded text once every reader is done with it."""
+        self._text = None
+
+
+def screen(headers: Dict[str, str], max_bytes: int) -> Optional[str]:
+    """Decide from the headers alone whether a body is worth reading."""
+    length: str = headers.get('Content-Length', '')
+    if length.isdigit() and int(length) > max_bytes:
+        return 'size'
+    content_type: str = headers.get('Content-Type', '').lower().strip()
+    if content_type and not any(content_type.startswith(t)
+                                for t in TEXT_TYPES):
+        return 'type'
+    return None
+
+
+def tally(responses: List[Response],
+          stats: Optional[Dict[str, int]] = None) -> List[Response]:
+    """Drop rejected responses and count what was read and what was saved."""
+    accepted: List[Response] = list()
+    for response in responses:
+        if stats is not None and not response.cached:
+            stats['status_%d' % response.status_code] += 1
+            stats['bytes_read'] += len(response.content)
+            stats['bytes_saved'] += response.saved
+        if response.rejected:
+            if stats is not None:
+                stats['rejected_%s' % response.rejected] += 1
+            continue
+        accepted.append(response)
+    return accepted
+
+
+class Backend(object):
+
+    """Shared behaviour for fetch backends.
+
+    Backends only need to implement `submit`, which starts a single request
+    and returns a future resolving to a `Response`. Bulk fetching is built on
+    top of it so modules can either wait on a whole batch or consume
+    responses as they complete.
+    """
+
+    name: ClassVar[str] = 'base'
+    log: ClassVar[logging.Logger] = LOG
+    concurrency: int = 8
+    #  Exceptions raised by the backend when a request runs out of time
+    timeouts: ClassVar[Tuple] = (TimeoutError,)
+
+    def submit(self, url: str, timeout: float = 7,
+               max_bytes: int = MAX_BYTES,
+               limiter: Optional[RateLimiter] = None) -> Future:
+        """Start a request and return a future for its response."""
+        raise NotImplementedError
+
+    def started(self, future: Future) -> Optional[float]:
+        """Get when a submitted request left the backend's queue.
+
+        Backends record the `time.perf_counter` reading at which a request
+        actually goes out in a `clock` dict attached to its future, once it
+        has its pool slot and rate limit token. Latency is measured from
+        the same point.
+
+        :returns: The start time, None while the request is still waiting
+        or for backends that don't record it.
+        """
+        return getattr(future, 'clock', dict()).get('start')
+
+    def busy(self) -> bool:
+        """Check whether every request slot is taken.
+
+        A request sent now would wait for one of them, so it can't overtake
+        a request that is already running.
+        """
+        return getattr(self, '_inflight', 0) >= self.concurrency
+
+    def _track(self, future: Future, clock: Dict[str, float]) -> Future:
+        """Attach the start clock to a request and count it until it ends."""
+        future.clock = clock
+        with self._lock:
+            self._inflight += 1
+        future.add_done_callback(self._untrack)
+        return future
+
+    def _untrack(self, future: Future) -> None:
+        """Stop counting a finished request."""
+        with self._lock:
+            self._inflight -= 1
+
+    def fetch(self, urls: List[str], timeout: float = 7,
+              max_bytes: int = MAX_BYTES,
+              stats: Optional[Dict[str, int]] = None,
+              limiter: Optional[RateLimiter] = None) -> List:
+        """Request all URLs and return the accepted responses."""
+        return list(self.iter_fetch(urls, timeout, max_bytes, stats,
+                                    limiter))
+
+    def iter_fetch(self, urls: List[str], timeout: float = 7,
+                   max_bytes: int = MAX_BYTES,
+                   stats: Optional[Dict[str, int]] = None,
+                   limiter: Optional[RateLimiter] = None,
+                   submit: Optional[Callable[[str], Future]] = None
+                   ) -> Iterator:
+        """Request all URLs and yield accepted responses as they complete.
+
+        Only about twice the backend concurrency is in flight at once and
+        new requests are sent as responses are consumed, so a caller that
+        reads each response and lets it go never holds more than that many
+        bodies in memory. Requests are started with `submit` when given,
+        which lets callers wrap them in a request policy.
+        """
+        if not submit:
+            submit = functools.partial(self.submit, timeout=timeout,
+                                       max_bytes=max_bytes, limiter=limiter)
+        queue: Deque[str] = deque(urls)
+        window: int = max(self.concurrency * 2, 1)
+        pending: Set[Future] = set()
+        while queue or pending:
+            while queue and len(pending) < window:
+                pending.add(submit(queue.popleft()))
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response: Response = future.result()
+                except Exception as err:
+                    self.log.warning("Failed result: %r", err)
+                    continue
+                yield from tally([response], stats)
+
+    def close(self) -> None:
+        """Release any held resources."""
+        pass
+
+
+class FuturesBackend(Backend):
+
+    """Thread-backed requests using a pooled session.
+
+    A single pooled session is kept for the life of the backend. Pool size
+    maps to the number of host pools kept warm, per-host caps map to the
+    connections kept per pool and idle hosts have their pools dropped.
+    """
+
+    name: ClassVar[str] = 'futures'
+    timeouts: ClassVar[Tuple] = (requests.exceptions.Timeout, TimeoutError)
+
+    def __init__(self, concurrency: Optional[int] = None,
+                 pool: Optional[Dict] = None) -> None:
+        """Setup the pooled session."""
+        self.concurrency: int = concurrency or 8
+        self.pool: Dict[str, Any] = dict(POOL_DEFAULTS, **(pool or dict()))
+        per_host: int = self.pool['per_host'] or self.concurrency
+        self.session: requests.Session = requests.Session()
+        for prefix in ['http://', 'https://']:
+            self.session.mount(prefix, HTTPAdapter(
+                pool_connections=self.pool['size'], pool_maxsize=per_host))
+        for host, size in self.pool['hosts'].items():
+            for prefix in ['http://', 'https://']:
+                self.session.mount(prefix + host, HTTPAdapter(
+                    pool_connections=1, pool_maxsize=size))
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=self.concurrency)
+        self._last_used: Dict[str, float] = dict()
+        self._last_evict: float = time.time()
+        self._lock: threading.Lock = threading.Lock()
+        self._inflight: int = 0
+
+    def _evict_idle(self) -> None:
+        """Drop connection pools for hosts not used within the idle window."""
+        cutoff: float = time.time() - self.pool['idle']
+        idle = [h for h, seen in self._last_used.items() if seen < cutoff]
+        if not idle:
+            return
+        for adapter in self.session.adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                if key.key_host in idle:
+                    del pools[key]
+        for host in idle:
+            del self._last_used[host]
+        self.log.debug("Evicted idle pools: %d", len(idle))
+
+    def _get(self, url: str, timeout: float, max_bytes: int,
+             limiter: Optional[RateLimiter] = None,
+             clock: Optional[Dict[str, float]] = None) -> Response:
+        """Request a single URL while respecting the rate limits."""
+        host: str = urlparse(url).hostname or ''
+        if limiter:
+            limiter.acquire(host)
+        start: float = time.perf_counter()
+        if clock is not None:
+            clock['start'] = start
+        try:
+            response: Response = self._stream(url, timeout, max_bytes)
+        finally:
+            if limiter:
+                limiter.release(host)
+        response.elapsed = time.perf_counter() - start
+        response.request_url = url
+        return response
+
+    def _stream(self, url: str, timeout: float, max_bytes: int) -> Response:
+        """Stream a single URL, aborting early on unwanted bodies."""
+        resp = self.session.get(url, headers=gen_headers(), timeout=timeout,
+                                verify=False, stream=True)
+        with resp:
+            headers = CaseInsensitiveDict(resp.headers)
+            response = Response(resp.url, resp.status_code, headers, b'')
+            response.rejected = screen(headers, max_bytes)
+            if response.rejected:
+                response.saved = int(headers.get('Content-Length') or 0)
+                return response
+            chunks: List[bytes] = list()
+            size: int = 0
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    response.rejected = 'size'
+                    response.saved = max(
+                        int(headers.get('Content-Length') or 0) - size, 0)
+                    return response
+                chunks.append(chunk)
+            response.content = b''.join(chunks)
+            return response
+
+    def submit(self, url: str, timeout: float = 7,
+               max_bytes: int = MAX_BYTES,
+               limiter: Optional[RateLimiter] = None) -> Future:
+        """Start a request on the thread pool."""
+        now: float = time.time()
+        with self._lock:
+            if now - self._last_evict > 1:
+                self._evict_idle()
+                self._last_evict = now
+            self._last_used[urlparse(url).hostname] = now
+        clock: Dict[str, float] = dict()
+        return self._track(self.executor.submit(
+            self._get, url, timeout, max_bytes, limiter, clock), clock)
+
+    def close(self) -> None:
+        """Release the pooled connections and worker threads."""
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+class AsyncBackend(Backend):
+
+    """Event loop driven requests allowing hundreds of in-flight calls.
+
+    The loop runs in a daemon thread for the life of the backend so the
+    underlying connector, and its keep-alive connections, can be shared by
+    every caller. Pool size caps total connections, per-host caps bound the
+    connections to a single host and idle connections are closed by the
+    connector once the idle window passes.
+    """
+
+    name: ClassVar[str] = 'asyncio'
+    timeouts: ClassVar[Tuple] = (asyncio.TimeoutError, TimeoutError)
+
+    def __init__(self, concurrency: Optional[int] = None,
+                 pool: Optional[Dict] = None) -> None:
+        """Setup the loop and pooled session."""
+        try:
+            import aiohttp  # noqa: F401
+        except ImportError:
+            raise Exception("The asyncio backend requires aiohttp, install "
+                            "it with `pip install frisbee[async]`")
+        self.concurrency: int = concurrency or 100
+        self.pool: Dict[str, Any] = dict(POOL_DEFAULTS, **(pool or dict()))
+        self._lock: threading.Lock = threading.Lock()
+        self._inflight: int = 0
+        self.loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+        self._thread: threading.Thread = threading.Thread(
+            target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        self._run(self._setup()).result()
+
+    def _run(self, coro):
+        """Schedule a coroutine on the backend loop."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def _setup(self) -> None:
+        """Create loop-bound objects from inside the loop."""
+        import aiohttp
+        connector = aiohttp.TCPConnector(
+            limit=self.pool['size'], limit_per_host=self.pool['per_host'] or 0,
+            keepalive_timeout=self.pool['idle'], ssl=False)
+        self.session = aiohttp.ClientSession(connector=connector)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.host_semaphores: Dict[str, asyncio.Semaphore] = {
+            host: asyncio.Semaphore(size)
+            for host, size in self.pool['hosts'].items()
+        }
+
+    async def _stream(self, url: str, timeout: float,
+                      max_bytes: int) -> Response:
+        """Stream a single URL, aborting early on unwanted bodies."""
+        import aiohttp
+        async with self.session.get(
+                url, headers=gen_headers(),
+                timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+            headers = CaseInsensitiveDict(resp.headers)
+            response = Response(str(resp.url), resp.status, headers, b'')
+            response.rejected = screen(headers, max_bytes)
+            if response.rejected:
+                response.saved = int(headers.get('Content-Length') or 0)
+                return response
+            chunks: List[bytes] = list()
+            size: int = 0
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    response.rejected = 'size'
+                    response.saved = max(
+                        int(headers.get('Content-Length') or 0) - size, 0)
+                    return response
+                chunks.append(chunk)
+            response.content = b''.join(chunks)
+            return response
+
+    async def _get(self, url: str, timeout: float, max_bytes: int,
+                   limiter: Optional[RateLimiter] = None,
+                   clock: Optional[Dict[str, float]] = None) -> Response:
+        """Request a single URL while respecting the concurrency caps."""
+        host: str = urlparse(url).hostname or ''
+        host_semaphore = self.host_semaphores.get(host)
+        async with self.semaphore:
+            if host_semaphore:
+                await host_semaphore.acquire()
+            if limiter:
+                await limiter.acquire_async(host)
+            start: float = time.perf_counter()
+            if clock is not None:
+                clock['start'] = start
+            try:
+                response: Response = await self._stream(url, timeout,
+                                                        max_bytes)
+            finally:
+                if limiter:
+                    limiter.release(host)
+                if host_semaphore:
+                    host_semaphore.release()
+            response.elapsed = time.perf_counter() - start
+        response.request_url = url
+        return response
+
+    def submit(self, url: str, timeout: float = 7,
+               max_bytes: int = MAX_BYTES,
+               limiter: Optional[RateLimiter] = None) -> Future:
+        """Start a request on the backend loop."""
+        clock: Dict[str, float] = dict()
+        return self._track(self._run(self._get(
+            url, timeout, max_bytes, limiter, clock)), clock)
+
+    def close(self) -> None:
+        """Close the session and stop the loop."""
+        self._run(self.session.close()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+BACKENDS: Dict[str, type] = {
+    FuturesBackend.name: FuturesBackend,
+    AsyncBackend.name: AsyncBackend,
+}
+_ACTIVE: Dict[str, Any] = dict()
+_ACTIVE_PID: int = os.getpid()
+_ACTIVE_LOCK: threading.Lock = threading.Lock()
+#  Backends inherited from a parent process, kept so they are never finalized
+_STALE: List[Any] = list()
+
+
+def get_backend(name: str, concurrency: Optional[int] = None,
+                pool: Optional[Dict] = None):
+    """Get the fetch backend identified by name.
+
+    Backends are created once per process and reused by every caller asking
+    for the same settings, keeping connections warm between the stages of a
+    job and across jobs handled by the same worker.
+    """
+    global _ACTIVE_PID, _ACTIVE_LOCK
+    if name not in BACKENDS:
+        raise Exception("Backend %s is not valid" % name)
+    if _ACTIVE_PID != os.getpid():
+        #  Forked workers must not reuse sockets or loops from the parent
+        _STALE.extend(_ACTIVE.values())
+        _ACTIVE.clear()
+        _ACTIVE_PID = os.getpid()
+        _ACTIVE_LOCK = threading.Lock()
+    key: str = json.dumps([name, concurrency, pool], sort_keys=True)
+    with _ACTIVE_LOCK:
+        if key not in _ACTIVE:
+            _ACTIVE[key] = BACKENDS[name](concurrency=concurrency, pool=pool)
+        return _ACTIVE[key]
+
+
+def close_backends() -> None:
+    """Close every backend created by this process."""
+    if _ACTIVE_PID != os.getpid():
+        return
+    for backend in _ACTIVE.values():
+        try:
+            backend.close()
+        except Exception as err:
+            LOG.warning("Failed to close backend: %s", err)
+    _ACTIVE.clear()
+
+
+atexit.register(close_backends)
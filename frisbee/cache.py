@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+import hashlib
+import json
+import os
+import tempfile
+import time
+import zlib
+from frisbee.backends import Response
+from requests.structures import CaseInsensitiveDict
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from urllib.parse import parse_qsl
+from urllib.parse import urlencode
+from urllib.parse import urlsplit
+from urllib.parse import urlunsplit
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+DEFAULT_PORTS: Dict[str, int] = {'http': 80, 'https': 443}
+
+
+def normalize_url(url: str) -> str:
+    """Reduce a URL to a canonical form for cache lookups."""
+    parts = urlsplit(url.strip())
+    scheme: str = parts.scheme.lower()
+    netloc: str = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc += ':%d' % parts.port
+    query: str = urlencode(sorted(parse_qsl(parts.query,
+                                            keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+class ResponseCache(object):
+
+    """Content-addressed on-disk cache of fetched responses.
+
+    Entries are keyed by the hash of the normalized URL and hold the
+    compressed body along with the headers needed to rebuild a response.
+    Writes go through a temporary file and an atomic rename so any number
+    of worker processes can share a cache directory. Reads refresh the
+    entry's modification time which doubles as the LRU clock when the
+    cache grows past its size limit.
+    """
+
+    def __init__(self, path: str, ttl: float = 86400,
+                 max_bytes: int = 512 * 1024 * 1024) -> None:
+        """Setup the cache directory."""
+        self.path: str = path
+        self.ttl: float = ttl
+        self.max_bytes: int = max_bytes
+        self._written: int = 0
+        os.makedirs(self.path, exist_ok=True)
+
+    def _entry(self, url: str) -> str:
+        """Get the file path holding the entry for a URL."""
+        digest: str = hashlib.sha256(
+            normalize_url(url).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, digest[:2], digest)
+
+    def get(self, url: str) -> Optional[Response]:
+        """Load a fresh cached response for the URL if there is one."""
+        entry: str = self._entry(url)
+        try:
+            with open(entry, 'rb') as handle:
+                raw: bytes = zlib.decompress(handle.read())
+            meta, content = raw.split(b'\n', 1)
+            details: Dict = json.loads(meta.decode('utf-8'))
+            if time.time() - details['stored'] > self.ttl:
+                self._remove(entry)
+                return None
+            os.utime(entry)
+        except (OSError, ValueError, KeyError, zlib.error):
+            return None
+        response = Response(details['url'], details['status'],
+                            CaseInsensitiveDict(details['headers']),
+                            content, details['encoding'])
+        response.cached = True
+        response.request_url = url
+        return response
+
+    def put(self, url: str, response: Response) -> None:
+        """Store a response under the URL it was requested with."""
+        entry: str = self._entry(url)
+        meta: bytes = json.dumps({
+            'url': response.url, 'status': response.status_code,
+            'headers': dict(response.headers), 'encoding': response.encoding,
+            'stored': time.time()
+        }).encode('utf-8')
+        data: bytes = zlib.compress(meta + b'\n' + response.content)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(entry), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as handle:
+                handle.write(data)
+            os.replace(tmp, entry)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        self._written += len(data)
+        if self._written > self.max_bytes / 10:
+            self._written = 0
+            self.evict()
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        """List entries as (last used, size, path) tuples."""
+        entries: List[Tuple[float, int, str]] = list()
+        for shard in os.scandir(self.path):
+            if not shard.is_dir():
+                continue
+            for item in os.scandir(shard.path):
+                try:
+                    stat = item.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, item.path))
+        return entries
+
+    def evict(self) -> None:
+        """Drop expired entries, then least recently used ones over the limit.
+
+        Only one process evicts at a time; others skip the pass rather than
+        wait on it.
+        """
+        with open(os.path.join(self.path, '.lock'), 'w') as lock:
+            if fcntl:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return
+            now: float = time.time()
+            total: int = 0
+            live: List[Tuple[float, int, str]] = list()
+            for used, size, path in self._entries():
+                if path.endswith('.tmp') and now - used < 60:
+                    continue
+                if path.endswith('.tmp') or now - used > self.ttl:
+                    self._remove(path)
+                    continue
+                live.append((used, size, path))
+                total += size
+            target: float = self.max_bytes * 0.9
+            for used, size, path in sorted(live):
+                if total <= target:
+                    break
+                self._remove(path)
+                total -= size
+
+    def _remove(self, path: str) -> None:
+        """Remove an entry that may already be gone."""
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+_CACHES: Dict[str, ResponseCache] = dict()
+
+
+def get_cache(path: str, ttl: float = 86400,
+              max_bytes: int = 512 * 1024 * 1024) -> ResponseCache:
+    """Get the cache for a directory, created once per process."""
+    key: str = json.dumps([os.path.abspath(path), ttl, max_bytes])
+    if key not in _CACHES:
+        _CACHES[key] = ResponseCache(path, ttl, max_bytes)
+    return _CACHES[key]
@@ -1,10 +1,71 @@
 #!/usr/bin/env python
 """Conduct searches for email addresses across different modules."""
+import csv
+import json
 import logging
+import os
 import sys
 
 from argparse import ArgumentParser
 from frisbee import Frisbee
+from frisbee.limiter import RateLimiter
+from frisbee.modules import is_module
+from frisbee.sinks import SQLiteSink
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import TextIO
+
+
+def print_job(job: Dict, handle: TextIO) -> None:
+    """Write the human readable report for a finished job."""
+    handle.write("-= %s Details =-\n" % job['project'].upper())
+    engines: Dict[str, List[str]] = job['results'].get('engines', dict())
+    handle.write("\t[*] Engine: %s\n" %
+                 ', '.join(engines or [job['engine']]))
+    handle.write("\t[*] Domain: %s\n" % job['domain'])
+    handle.write("\t[*] Modifer: %s\n" % job['modifier'])
+    handle.write("\t[*] Limit: %d\n" % job['limit'])
+    handle.write("\t[*] Duration: %s seconds\n" % job['duration'])
+    handle.write("\t[*] Count: %d\n" % len(job['results']['emails']))
+    if len(engines) > 1:
+        handle.write("\t[*] Per engine: %s\n" % ', '.join(
+            '%s %d' % (name, len(found)) for name, found in engines.items()))
+
+    handle.write("\n-= Email Results=-\n")
+    if not len(job['results']['emails']):
+        handle.write("No results\n")
+    for email in job['results']['emails']:
+        handle.write(email + "\n")
+    handle.write("\n")
+
+
+def reporter(fmt: str, handle: TextIO) -> Callable[[Dict], None]:
+    """Build the callback writing each finished job in the given format.
+
+    Text and ndjson write a job at a time while csv writes a row for each
+    email found by each engine. Output is flushed per job so it can be
+    piped along.
+    """
+    writer = csv.writer(handle)
+    if fmt == 'csv':
+        writer.writerow(['project', 'engine', 'domain', 'email'])
+
+    def report(job: Dict) -> None:
+        if fmt == 'ndjson':
+            handle.write(json.dumps(job, default=str) + "\n")
+        elif fmt == 'csv':
+            engines: Dict[str, List[str]] = job['results'].get(
+                'engines', {job['engine']: job['results']['emails']})
+            for engine, emails in engines.items():
+                for email in emails:
+                    writer.writerow([job['project'], engine, job['domain'],
+                                     email])
+        else:
+            print_job(job, handle)
+        handle.flush()
+
+    return report
 
 
 def main():
@@ -13,8 +74,9 @@ def main():
     subs = parser.add_subparsers(dest='cmd')
     setup_parser = subs.add_parser('search')
     setup_parser.add_argument('-e', '--engine', dest='engine', required=True,
-                              help='Search engine to use.',
-                              choices=['bing'])
+                              action='append',
+                              help='Search engine to use, repeat to search '
+                              'every domain through several engines.')
     group = setup_parser.add_mutually_exclusive_group()
     group.add_argument('-d', '--domain', dest='domain', required=False,
                        help='Email domain to collect upon.', type=str)
@@ -29,50 +91,237 @@ def main():
     setup_parser.add_argument('-s', '--save', dest='to_save', required=False,
                               help='Save results to a file.', default=False,
                               action='store_true')
+    setup_parser.add_argument('--output', dest='output', required=False,
+                              help='Format finished jobs are written in.',
+                              choices=['text', 'ndjson', 'csv'],
+                              default='text')
+    setup_parser.add_argument('--output-file', dest='output_file',
+                              required=False, type=str, default=None,
+                              help='Write output to a file, not stdout.')
+    setup_parser.add_argument('--resume', dest='resume', required=False,
+                              help='Resume an interrupted project by name.',
+                              type=str, default=None)
+    setup_parser.add_argument('--sink', dest='sink', required=False,
+                              help='Format saved results are written in.',
+                              choices=['files', 'jsonl', 'sqlite'],
+                              default='files')
     setup_parser.add_argument('--greedy', dest='greedy', required=False,
                               help='Use found results to search more.', default=False,
                               action='store_true')
+    setup_parser.add_argument('--max-depth', dest='max_depth',
+                              required=False, type=int, default=1,
+                              help='Levels of greedy expansion to follow.')
+    setup_parser.add_argument('--max-domains', dest='max_domains',
+                              required=False, type=int, default=0,
+                              help='Cap on total domains searched, input and '
+                              'greedy ones alike.')
+    setup_parser.add_argument('--batch-size', dest='batch_size',
+                              required=False, type=int, default=1,
+                              help='Most domains searched with one OR query, '
+                              'adapted to how many results come back.')
     setup_parser.add_argument('--fuzzy', dest='fuzzy', required=False,
                               help='Use keyword instead of domain.', default=False,
                               action='store_true')
+    setup_parser.add_argument('--backend', dest='backend', required=False,
+                              help='Fetch backend to perform requests with.',
+                              choices=['futures', 'asyncio'], default='futures')
+    setup_parser.add_argument('--concurrency', dest='concurrency',
+                              required=False, type=int, default=None,
+                              help='Max in-flight requests per worker '
+                              'process, shared by all of its jobs.')
+    setup_parser.add_argument('--timeout', dest='timeout', required=False,
+                              help='Per-request timeout in seconds, the '
+                              'ceiling of adaptive timeouts.',
+                              type=float, default=7)
+    setup_parser.add_argument('--fixed-timeout', dest='fixed_timeout',
+                              action='store_true', default=False,
+                              help='Always wait the full timeout instead of '
+                              'deriving it from host latency.')
+    setup_parser.add_argument('--retries', dest='retries', required=False,
+                              help='Retries of failed or throttled SERPs.',
+                              type=int, default=2)
+    setup_parser.add_argument('--hedge', dest='hedge', action='store_true',
+                              default=False,
+                              help='Send a duplicate of requests running past '
+                              'their host\'s p95 latency.')
+    setup_parser.add_argument('--pool-size', dest='pool_size', required=False,
+                              help='Connections kept alive per worker.',
+                              type=int, default=100)
+    setup_parser.add_argument('--pool-per-host', dest='pool_per_host',
+                              required=False, type=int, default=None,
+                              help='Max connections to a single host.')
+    setup_parser.add_argument('--pool-idle', dest='pool_idle', required=False,
+                              help='Seconds before idle connections close.',
+                              type=float, default=30)
+    setup_parser.add_argument('--host-pool', dest='host_pool', required=False,
+                              help='Per-host connection cap as HOST=SIZE.',
+                              action='append', default=[])
+    setup_parser.add_argument('--max-bytes', dest='max_bytes', required=False,
+                              help='Abort page downloads beyond this size.',
+                              type=int, default=3000000)
+    setup_parser.add_argument('--rate', dest='rate', required=False,
+                              help='Max requests per second to each host.',
+                              type=float, default=0)
+    setup_parser.add_argument('--global-rate', dest='global_rate',
+                              required=False, type=float, default=0,
+                              help='Max requests per second overall.')
+    setup_parser.add_argument('--host-rate', dest='host_rate', required=False,
+                              help='Per-host request rate as HOST=RATE.',
+                              action='append', default=[])
+    setup_parser.add_argument('--burst', dest='burst', required=False,
+                              help='Requests allowed in a burst per host.',
+                              type=int, default=1)
+    setup_parser.add_argument('--max-per-host', dest='max_per_host',
+                              required=False, type=int, default=0,
+                              help='Max concurrent requests to one host.')
+    setup_parser.add_argument('--pipeline', dest='pipeline', required=False,
+                              help='Stream SERPs into page fetches.',
+                              default=False, action='store_true')
+    setup_parser.add_argument('--queue-size', dest='queue_size',
+                              required=False, type=int, default=100,
+                              help='In-flight requests per pipeline stage.')
+    setup_parser.add_argument('--adaptive', dest='adaptive', required=False,
+                              help='Stop paging once results run dry.',
+                              default=False, action='store_true')
+    setup_parser.add_argument('--wave', dest='wave', required=False,
+                              help='SERPs fetched per adaptive paging wave.',
+                              type=int, default=3)
+    setup_parser.add_argument('--extractor', dest='extractor',
+                              required=False, default='soup',
+                              choices=['soup', 'fast'],
+                              help='Page text extraction strategy.')
+    setup_parser.add_argument('--cache', dest='cache', required=False,
+                              help='Cache responses on disk, optionally at '
+                              'the given path.', nargs='?', default=None,
+                              const=os.path.join(os.getcwd(), 'results',
+                                                 'cache'))
+    setup_parser.add_argument('--cache-ttl', dest='cache_ttl', required=False,
+                              help='Seconds a cached response stays fresh.',
+                              type=float, default=86400)
+    setup_parser.add_argument('--cache-max-bytes', dest='cache_max_bytes',
+                              required=False, type=int,
+                              default=512 * 1024 * 1024,
+                              help='Size the cache is trimmed back under.')
+    setup_parser.add_argument('--executor', dest='executor',
+                              required=False, default='processes',
+                              choices=['threads', 'processes', 'hybrid'],
+                              help='How jobs are run concurrently.')
+    setup_parser.add_argument('--workers', dest='workers', required=False,
+                              help='Threads or processes running jobs.',
+                              type=int, default=None)
+    setup_parser.add_argument('--jobs-per-worker', dest='jobs_per_worker',
+                              required=False, type=int, default=16,
+                              help='Concurrent jobs per hybrid process.')
+    setup_parser.add_argument('--metrics-json', dest='metrics_json',
+                              required=False, type=str, default=None,
+                              help='Write run metrics as JSON to a file.')
+    setup_parser.add_argument('--metrics-prom', dest='metrics_prom',
+                              required=False, type=str, default=None,
+                              help='Write run metrics in Prometheus text '
+                              'format to a file.')
+    setup_parser.add_argument('--log-level', dest='log_level',
+                              required=False, default='info',
+                              choices=['debug', 'info', 'warning', 'error'],
+                              help='Least severe log records to write.')
+    setup_parser.add_argument('--log-format', dest='log_format',
+                              required=False, default='text',
+                              choices=['text', 'json'],
+                              help='Write logs to stderr as text lines or '
+                              'one JSON object per line.')
+    setup_parser.add_argument('--dedup', dest='dedup', required=False,
+                              help='Share fetched pages between jobs.',
+                              default=False, action='store_true')
+    query_parser = subs.add_parser('query')
+    query_parser.add_argument('-d', '--domain', dest='domain', required=True,
+                              help='Domain to list saved emails for.',
+                              type=str)
+    query_parser.add_argument('-p', '--project', dest='project',
+                              required=False, type=str, default=None,
+                              help='Only list emails from this project.')
+    query_parser.add_argument('--database', dest='database', required=False,
+                              help='SQLite results database to read.',
+                              default=os.path.join(os.getcwd(), 'results',
+                                                   'frisbee.db'))
     args = parser.parse_args()
 
     if not args.cmd:
         parser.print_help()
+        sys.exit(1)
 
     if args.cmd == 'search':
-        frisbee = Frisbee(log_level=logging.DEBUG, save=args.to_save)
+        engines = list(dict.fromkeys(args.engine))
+        for engine in engines:
+            if not is_module(engine):
+                parser.error("Module %s is not valid" % engine)
+        rate_limiter = None
+        if args.rate or args.global_rate or args.host_rate or \
+                args.max_per_host:
+            host_rates = dict()
+            for item in args.host_rate:
+                host, rate = item.split('=', 1)
+                host_rates[host] = float(rate)
+            rate_limiter = RateLimiter(rate=args.rate,
+                                       global_rate=args.global_rate,
+                                       burst=args.burst,
+                                       max_per_host=args.max_per_host,
+                                       hosts=host_rates)
+        resume = dict()
+        if args.resume:
+            resume = {'project': args.resume, 'resume': True}
+        frisbee = Frisbee(log_level=getattr(logging, args.log_level.upper()),
+                          log_format=args.log_format, save=args.to_save,
+                          keep_results=False,
+                          rate_limiter=rate_limiter, dedup=args.dedup,
+                          max_depth=args.max_depth,
+                          max_domains=args.max_domains,
+                          batch_size=args.batch_size,
+                          executor=args.executor, workers=args.workers,
+                          jobs_per_worker=args.jobs_per_worker,
+                          sink=args.sink, metrics_json=args.metrics_json,
+                          metrics_prom=args.metrics_prom, **resume)
+        pool = {'size': args.pool_size, 'per_host': args.pool_per_host,
+                'idle': args.pool_idle, 'hosts': dict()}
+        for item in args.host_pool:
+            host, size = item.split('=', 1)
+            pool['hosts'][host] = int(size)
+        options = {'engine': engines if len(engines) > 1 else engines[0],
+                   'modifier': args.modifier, 'limit': args.limit,
+                   'greedy': args.greedy, 'fuzzy': args.fuzzy,
+                   'backend': args.backend,
+                   'concurrency': args.concurrency, 'timeout': args.timeout,
+                   'pool': pool, 'max_bytes': args.max_bytes,
+                   'pipeline': args.pipeline, 'queue_size': args.queue_size,
+                   'adaptive': args.adaptive, 'wave': args.wave,
+                   'extractor': args.extractor, 'cache': args.cache,
+                   'cache_ttl': args.cache_ttl,
+                   'cache_max_bytes': args.cache_max_bytes,
+                   'retries': args.retries, 'hedge': args.hedge,
+                   'adaptive_timeout': not args.fixed_timeout}
         if args.domain:
-            jobs = [{'engine': args.engine, 'modifier': args.modifier,
-                     'domain': args.domain, 'limit': args.limit,
-                     'greedy': args.greedy, 'fuzzy': args.fuzzy}]
+            jobs = [dict(options, domain=args.domain)]
 
         if args.file:
-            domains = [x.strip() for x in open(args.file, 'r').readlines()]
-            domains = list(set(domains))
-            jobs = list()
-            for domain in domains:
-                job = {'engine': args.engine, 'modifier': args.modifier,
-                       'domain': domain, 'limit': args.limit,
-                       'greedy': args.greedy, 'fuzzy': args.fuzzy}
-                jobs.append(job)
-
-        frisbee.search(jobs)
-        results = frisbee.get_results()
-        for job in results:
-            print("-= %s Details =-" % job['project'].upper())
-            print("\t[*] Engine: %s" % job['engine'])
-            print("\t[*] Domain: %s" % job['domain'])
-            print("\t[*] Modifer: %s" % job['modifier'])
-            print("\t[*] Limit: %d" % job['limit'])
-            print("\t[*] Duration: %s seconds" % job['duration'])
-            print("\t[*] Count: %d" % len(job['results']['emails']))
-
-            print("\n-= Email Results=-")
-            if not len(job['results']['emails']):
-                print("No results")
-            for email in job['results']['emails']:
-                print(email)
-            print("")
-
-    sys.exit(1)
+            #  Domains are read lazily, Frisbee skips repeats as it goes
+            source = open(args.file, 'r')
+            jobs = (dict(options, domain=line.strip()) for line in source
+                    if line.strip())
+
+        handle = sys.stdout
+        if args.output_file:
+            handle = open(args.output_file, 'w', newline='')
+        frisbee.search(jobs, callback=reporter(args.output, handle))
+        if args.output_file:
+            handle.close()
+        if args.file:
+            source.close()
+        sys.exit(0)
+
+    if args.cmd == 'query':
+        if not os.path.exists(args.database):
+            print("No results database at %s" % args.database)
+            sys.exit(1)
+        sink = SQLiteSink(os.path.dirname(args.database), path=args.database)
+        for email in sink.emails(args.domain, args.project):
+            print(email)
+        sink.close()
+        sys.exit(0)
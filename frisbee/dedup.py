@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+import bisect
+import hashlib
+import heapq
+import uuid
+from array import array
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+
+#  Recent keys a KeySet holds before merging them in, at the least
+MERGE_MIN: int = 1024
+
+
+class PageRegistry(object):
+
+    """Registry of result pages shared by every job of a run.
+
+    Related domains tend to surface the same pages, so the first job to
+    claim a URL fetches it and publishes the candidate emails found on it.
+    Other jobs reuse those candidates, or wait for them while the page is
+    in flight, instead of downloading and parsing the page again. State
+    lives in a manager dictionary so claims are atomic across processes.
+    """
+
+    def __init__(self, manager) -> None:
+        """Setup the shared dictionary from a running manager."""
+        self._pages = manager.dict()
+
+    def claim(self, url: str) -> Tuple[bool, Optional[List[str]]]:
+        """Try to become the fetcher for a URL.
+
+        :returns: Whether the caller owns the fetch along with the published
+        candidates when another job already finished it.
+        """
+        token: str = uuid.uuid4().hex
+        value = self._pages.setdefault(url, token)
+        if value == token:
+            return True, None
+        if isinstance(value, list):
+            return False, value
+        return False, None
+
+    def lookup(self, url: str) -> Optional[List[str]]:
+        """Get the published candidates for a URL if there are any yet."""
+        value = self._pages.get(url)
+        return value if isinstance(value, list) else None
+
+    def publish(self, url: str, hits: List[str]) -> None:
+        """Share the candidates found on a page the caller claimed."""
+        self._pages[url] = list(hits)
+
+
+class KeySet(object):
+
+    """Set of strings kept as 64-bit digests for very long inputs.
+
+    Digests live in a sorted array at 8 bytes each and are looked up with a
+    binary search. New ones wait in a small set that is merged in once it
+    outgrows an eighth of the array, so merges stay rare and the set never
+    holds more than a fraction of the keys as Python objects.
+    """
+
+    def __init__(self) -> None:
+        """Start out empty."""
+        self._keys: array = array('Q')
+        self._recent: Set[int] = set()
+
+    def _digest(self, value: str) -> int:
+        """Reduce a string to its 64-bit key."""
+        return int.from_bytes(hashlib.blake2b(
+            value.encode('utf-8'), digest_size=8).digest(), 'little')
+
+    def _has(self, key: int) -> bool:
+        """Check for a key among the recent and the merged ones."""
+        if key in self._recent:
+            return True
+        i: int = bisect.bisect_left(self._keys, key)
+        return i < len(self._keys) and self._keys[i] == key
+
+    def __contains__(self, value: str) -> bool:
+        """Check whether a string was added."""
+        return self._has(self._digest(value))
+
+    def __len__(self) -> int:
+        """Count the distinct strings added."""
+        return len(self._keys) + len(self._recent)
+
+    def add(self, value: str) -> bool:
+        """Add a string, returning False if it was already there."""
+        key: int = self._digest(value)
+        if self._has(key):
+            return False
+        self._recent.add(key)
+        if len(self._recent) > max(MERGE_MIN, len(self._keys) // 8):
+            self._keys = array('Q', heapq.merge(self._keys,
+                                                sorted(self._recent)))
+            self._recent = set()
+        return True
+
+
+_REGISTRY: Optional[PageRegistry] = None
+
+
+def install(registry: Optional[PageRegistry]) -> None:
+    """Make a registry the one used by every job in this process."""
+    global _REGISTRY
+    _REGISTRY = registry
+
+
+def current() -> Optional[PageRegistry]:
+    """Get the registry installed for this process, if any."""
+    return _REGISTRY
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+import collections
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import threading
+import traceback
+from concurrent.futures import Executor
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from frisbee.utils import gen_logger
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+
+LOG: logging.Logger = gen_logger('executors')
+EXECUTORS: List[str] = ['threads', 'processes', 'hybrid']
+THREAD_WORKERS: int = 32
+JOBS_PER_WORKER: int = 16
+
+
+def _pack(func: Callable, args: Tuple,
+          kwargs: Dict) -> Tuple[bool, bytes, str]:
+    """Run a call and pickle its outcome so it can always be sent back.
+
+    Results or errors that can't be pickled, or that pickle but can't be
+    loaded again, are replaced by a plain exception naming them. The
+    traceback travels as text alongside.
+
+    :returns: Whether the call succeeded, the pickled outcome and the
+    traceback of a failure.
+    """
+    try:
+        return True, pickle.dumps(func(*args, **kwargs)), ''
+    except Exception as err:
+        trace: str = traceback.format_exc()
+        try:
+            payload: bytes = pickle.dumps(err)
+            pickle.loads(payload)
+        except Exception:
+            payload = pickle.dumps(Exception(repr(err)))
+        return False, payload, trace
+
+
+def _hybrid_worker(tasks, results, threads: int,
+                   initializer: Optional[Callable], initargs: Tuple) -> None:
+    """Run jobs from the task queue on a set of threads until told to stop."""
+    if initializer:
+        initializer(*initargs)
+
+    def run() -> None:
+        while True:
+            item = tasks.get()
+            if item is None:
+                return
+            task_id, func, args, kwargs = item
+            results.put((task_id,) + _pack(func, args, kwargs))
+
+    runners: List[threading.Thread] = [threading.Thread(target=run)
+                                       for _ in range(threads)]
+    for runner in runners:
+        runner.start()
+    for runner in runners:
+        runner.join()
+    from frisbee.backends import close_backends
+    close_backends()
+
+
+class HybridExecutor(Executor):
+
+    """Process pool where each process runs many jobs at once.
+
+    Jobs spend most of their time waiting on the network, so a handful of
+    processes each running `jobs_per_worker` jobs on threads keeps hundreds
+    of searches going without a process per job. The jobs in a process share
+    its fetch backend, which bounds I/O concurrency separately. Tasks are
+    pulled from a shared queue so busy processes never hold up idle ones.
+
+    Like the standard pools, tasks wait on our side until a slot frees up
+    and are marked running as they are handed over, so cancelling one that
+    hasn't started keeps it from ever running.
+    """
+
+    def __init__(self, workers: Optional[int] = None,
+                 jobs_per_worker: int = JOBS_PER_WORKER,
+                 initializer: Optional[Callable] = None,
+                 initargs: Tuple = ()) -> None:
+        """Start the worker processes and the result collector."""
+        self.workers: int = workers or os.cpu_count() or 1
+        self.jobs_per_worker: int = max(jobs_per_worker, 1)
+        self._tasks = multiprocessing.Queue()
+        self._results = multiprocessing.Queue()
+        self._futures: Dict[int, Future] = dict()
+        self._backlog: Deque[Tuple] = collections.deque()
+        #  One spare task per process so threads don't idle on round trips
+        self._slots: int = self.workers * (self.jobs_per_worker + 1)
+        self._sent: int = 0
+        self._ids = itertools.count()
+        self._lock: threading.Lock = threading.Lock()
+        self._closed: bool = False
+        self._processes: List[multiprocessing.Process] = list()
+        for _ in range(self.workers):
+            process = multiprocessing.Process(
+                target=_hybrid_worker, daemon=True,
+                args=(self._tasks, self._results, self.jobs_per_worker,
+                      initializer, initargs))
+            process.start()
+            self._processes.append(process)
+        self._collector: threading.Thread = threading.Thread(
+            target=self._collect, daemon=True)
+        self._collector.start()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Queue a call for the next free job slot."""
+        if self._closed:
+            raise Exception("Cannot submit after shutdown")
+        future: Future = Future()
+        with self._lock:
+            task_id: int = next(self._ids)
+            self._futures[task_id] = future
+            self._backlog.append((task_id, fn, args, kwargs))
+        self._dispatch()
+        return future
+
+    def _dispatch(self, flush: bool = False) -> None:
+        """Hand waiting tasks to the workers while there are free slots.
+
+        Tasks whose future was cancelled in the meantime are dropped.
+        """
+        with self._lock:
+            while self._backlog and (flush or self._sent < self._slots):
+                task: Tuple = self._backlog.popleft()
+                future: Optional[Future] = self._futures.get(task[0])
+                if not future:
+                    continue
+                if not future.set_running_or_notify_cancel():
+                    del self._futures[task[0]]
+                    continue
+                self._sent += 1
+                self._tasks.put(task)
+
+    def _collect(self) -> None:
+        """Resolve futures as results come back from the workers."""
+        while True:
+            try:
+                item = self._results.get(timeout=1)
+            except queue.Empty:
+                if self._closed or all(p.is_alive() for p in self._processes):
+                    continue
+                self._fail(Exception("A worker process died unexpectedly"))
+                return
+            except Exception as err:
+                LOG.error("Unreadable result from a worker: %r", err)
+                continue
+            if item is None:
+                return
+            task_id, ok, payload, trace = item
+            with self._lock:
+                future: Optional[Future] = self._futures.pop(task_id, None)
+                self._sent -= 1
+            self._dispatch()
+            if not future or future.done():
+                continue
+            try:
+                value = pickle.loads(payload)
+            except Exception as err:
+                ok, value = False, Exception(
+                    "Result could not be loaded: %r" % err)
+            if ok:
+                future.set_result(value)
+                continue
+            if trace:
+                #  Chained like the process pool does, shown under the error
+                value.__cause__ = Exception('\n"""\n%s"""' % trace)
+            future.set_exception(value)
+
+    def _fail(self, err: Exception) -> None:
+        """Fail every outstanding future and refuse new ones."""
+        LOG.error(str(err))
+        self._closed = True
+        with self._lock:
+            futures: List[Future] = list(self._futures.values())
+            self._futures.clear()
+            self._backlog.clear()
+        for future in futures:
+            if not future.done():
+                future.set_exception(err)
+
+    def shutdown(self, wait: bool = True, **kwargs) -> None:
+        """Stop the workers once the queued tasks are done."""
+        if self._closed:
+            return
+        self._closed = True
+        self._dispatch(flush=True)
+        with self._lock:
+            for _ in range(self.workers * self.jobs_per_worker):
+                self._tasks.put(None)
+        if not wait:
+            return
+        for process in self._processes:
+            process.join()
+        self._results.put(None)
+        self._collector.join()
+
+
+def get_executor(name: str, workers: Optional[int] = None,
+                 jobs_per_worker: int = JOBS_PER_WORKER,
+                 initializer: Optional[Callable] = None,
+                 initargs: Tuple = ()) -> Tuple[Executor, int]:
+    """Create the executor identified by name.
+
+    :returns: The executor along with the number of jobs it runs at once.
+    """
+    if name not in EXECUTORS:
+        raise Exception("Executor %s is not valid" % name)
+    if name == 'threads':
+        workers = workers or THREAD_WORKERS
+        return ThreadPoolExecutor(max_workers=workers), workers
+    workers = workers or os.cpu_count() or 1
+    if name == 'processes':
+        return ProcessPoolExecutor(max_workers=workers,
+                                   initializer=initializer,
+                                   initargs=initargs), workers
+    executor = HybridExecutor(workers, jobs_per_worker, initializer, initargs)
+    return executor, workers * executor.jobs_per_worker
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+import json
+import os
+from typing import Any
+from typing import Dict
+from typing import Set
+from typing import Tuple
+
+
+class Journal(object):
+
+    """Append-only checkpoint log of the jobs in a project.
+
+    Every job is recorded when it is queued or sent to a worker and again
+    once it is done, one JSON line each, flushed as it is written. Replaying
+    the log after a crash tells which domains are finished and which jobs
+    were queued or in flight and have to run again.
+    """
+
+    def __init__(self, folder: str, project: str) -> None:
+        """Open the project journal for appending."""
+        os.makedirs(folder, exist_ok=True)
+        self.path: str = os.path.join(folder, project + '.journal')
+        self._handle = None
+
+    def exists(self) -> bool:
+        """Check whether the project has been journaled before."""
+        return os.path.exists(self.path)
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        """Write a single entry through to disk."""
+        if not self._handle:
+            self._handle = open(self.path, 'a')
+        self._handle.write(json.dumps(entry, default=str) + '\n')
+        self._handle.flush()
+
+    def queued(self, job: Dict[str, Any], depth: int) -> None:
+        """Record a job waiting to be run."""
+        self._append({'event': 'queued', 'depth': depth, 'job': job})
+
+    def started(self, job: Dict[str, Any], depth: int) -> None:
+        """Record a job handed to a worker."""
+        self._append({'event': 'started', 'depth': depth, 'job': job})
+
+    def done(self, domain: str) -> None:
+        """Record a domain as finished."""
+        self._append({'event': 'done', 'domain': domain})
+
+    def replay(self) -> Tuple[Set[str], Dict[str, Tuple[int, Dict]]]:
+        """Read back the journal.
+
+        :returns: Finished domains and the unfinished jobs, with their
+        depth, keyed by domain.
+        """
+        done: Set[str] = set()
+        pending: Dict[str, Tuple[int, Dict]] = dict()
+        if not self.exists():
+            return done, pending
+        with open(self.path, 'r') as handle:
+            for line in handle:
+                try:
+                    entry: Dict[str, Any] = json.loads(line)
+                except ValueError:
+                    #  A crash can leave the last line half written
+                    continue
+                if entry['event'] == 'done':
+                    done.add(entry['domain'])
+                    pending.pop(entry['domain'], None)
+                    continue
+                domain: str = entry['job']['domain']
+                if domain not in done:
+                    pending[domain] = (entry['depth'], entry['job'])
+        return done, pending
+
+    def close(self) -> None:
+        """Close the journal file."""
+        if self._handle:
+            self._handle.close()
+            self._handle = None
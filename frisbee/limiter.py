@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+import multiprocessing
+import time
+import zlib
+from typing import Dict
+from typing import Optional
+
+
+class RateLimiter(object):
+
+    """Per-host token buckets shared between worker processes.
+
+    Buckets live in shared memory so every worker of a pool draws from the
+    same budget. Hosts are hashed into a fixed number of slots; hosts sharing
+    a slot share a budget, which only errs on the side of being polite. Each
+    slot keeps the theoretical arrival time of the next request along with
+    the number of requests currently in flight. Slot zero is the global
+    bucket. A rate of zero disables that bucket.
+    """
+
+    POLL: float = 0.05
+
+    def __init__(self, rate: float = 0, global_rate: float = 0,
+                 burst: int = 1, max_per_host: int = 0,
+                 hosts: Optional[Dict[str, float]] = None,
+                 slots: int = 4096) -> None:
+        """Setup the shared buckets."""
+        self.rate: float = rate
+        self.global_rate: float = global_rate
+        self.burst: int = max(burst, 1)
+        self.max_per_host: int = max_per_host
+        self.hosts: Dict[str, float] = hosts or dict()
+        self.slots: int = slots
+        self._tat = multiprocessing.Array('d', slots, lock=False)
+        self._inflight = multiprocessing.Array('i', slots, lock=False)
+        self._lock = multiprocessing.Lock()
+
+    def _slot(self, host: str) -> int:
+        """Map a host onto one of the shared slots."""
+        return zlib.crc32(host.encode('utf-8')) % (self.slots - 1) + 1
+
+    def _reserve(self, slot: int, rate: float, now: float) -> float:
+        """Reserve the next opening in a bucket and return the wait."""
+        if rate <= 0:
+            return 0.0
+        interval: float = 1.0 / rate
+        tat: float = max(self._tat[slot], now)
+        allowed: float = tat - (self.burst - 1) * interval
+        self._tat[slot] = tat + interval
+        return max(allowed - now, 0.0)
+
+    def _try(self, host: str) -> Optional[float]:
+        """Claim an in-flight slot and a rate reservation for the host.
+
+        :returns: Seconds to wait before sending or None when the host is
+        already at its concurrency cap.
+        """
+        slot: int = self._slot(host)
+        with self._lock:
+            if self.max_per_host and \
+                    self._inflight[slot] >= self.max_per_host:
+                return None
+            self._inflight[slot] += 1
+            now: float = time.time()
+            delay: float = self._reserve(slot, self.hosts.get(host, self.rate),
+                                         now)
+            return max(delay, self._reserve(0, self.global_rate, now))
+
+    def acquire(self, host: str) -> None:
+        """Block until a request to the host may be sent."""
+        delay: Optional[float] = self._try(host)
+        while delay is None:
+            time.sleep(self.POLL)
+            delay = self._try(host)
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self, host: str) -> None:
+        """Wait on the event loop until a request to the host may be sent."""
+        import asyncio
+        delay: Optional[float] = self._try(host)
+        while delay is None:
+            await asyncio.sleep(self.POLL)
+            delay = self._try(host)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def release(self, host: str) -> None:
+        """Mark a request to the host as finished."""
+        slot: int = self._slot(host)
+        with self._lock:
+            self._inflight[slot] = max(self._inflight[slot] - 1, 0)
+
+
+_LIMITER: Optional[RateLimiter] = None
+
+
+def install(limiter: Optional[RateLimiter]) -> None:
+    """Make a limiter the one used by every request in this process."""
+    global _LIMITER
+    _LIMITER = limiter
+
+
+def current() -> Optional[RateLimiter]:
+    """Get the limiter installed for this process, if any."""
+    return _LIMITER
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+import datetime
+import json
+import logging
+import sys
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+from typing import Dict
+from typing import Optional
+from typing import TextIO
+
+
+#  Namespace every frisbee logger lives under, output is handled here once
+ROOT: str = 'frisbee'
+TEXT_FORMAT: str = ('%(levelname)-5s %(processName)s %(module)s:'
+                    '%(funcName)s():%(lineno)d %(asctime)s| %(message)s')
+
+_handler: Optional[logging.Handler] = None
+
+
+class TextFormatter(logging.Formatter):
+
+    """Human readable lines, colored when written to a terminal."""
+
+    def __init__(self, color: bool = False) -> None:
+        """Set the line layout."""
+        super(TextFormatter, self).__init__(TEXT_FORMAT)
+        self.color: bool = color
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Render a record as a single line."""
+        line: str = super(TextFormatter, self).format(record)
+        if not self.color:
+            return line
+        prefix, _, message = line.partition('| ')
+        return '\033[1;32m%s\033[0m| %s' % (prefix, message)
+
+
+class JSONFormatter(logging.Formatter):
+
+    """One JSON object per record for log shippers."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Render a record as a JSON line."""
+        entry: Dict = {
+            'time': datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname, 'logger': record.name,
+            'process': record.processName, 'pid': record.process,
+            'function': record.funcName, 'line': record.lineno,
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            entry['error'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+LOG_FORMATS: Dict[str, type] = {'text': TextFormatter, 'json': JSONFormatter}
+
+
+def get_formatter(name: str, stream: TextIO) -> logging.Formatter:
+    """Create the formatter identified by name for a stream."""
+    if name not in LOG_FORMATS:
+        raise Exception("Log format %s is not valid" % name)
+    if name == 'text':
+        return TextFormatter(color=getattr(stream, 'isatty', bool)())
+    return LOG_FORMATS[name]()
+
+
+def _swap(handler: logging.Handler) -> None:
+    """Make the handler the only one on the namespace."""
+    global _handler
+    root: logging.Logger = logging.getLogger(ROOT)
+    if _handler:
+        root.removeHandler(_handler)
+    root.addHandler(handler)
+    root.propagate = False
+    _handler = handler
+
+
+def setup(fmt: Optional[str] = None, level: Optional[int] = None,
+          stream: Optional[TextIO] = None) -> logging.Logger:
+    """Configure where and how records under the namespace are written.
+
+    The first call adds a handler writing text to stderr at INFO. Later calls
+    only change what they are given, so calling this from every module that
+    wants a logger never stacks handlers.
+    """
+    root: logging.Logger = logging.getLogger(ROOT)
+    if level is not None:
+        root.setLevel(level)
+    elif root.level == logging.NOTSET:
+        root.setLevel(logging.INFO)
+    if _handler and fmt is None and stream is None:
+        return root
+    stream = stream or sys.stderr
+    handler: logging.Handler = logging.StreamHandler(stream)
+    handler.setFormatter(get_formatter(fmt or 'text', stream))
+    _swap(handler)
+    return root
+
+
+def listen(log_queue) -> QueueListener:
+    """Write records workers put on the queue through this process's handler.
+
+    :returns: The started listener, stop it once the workers are done.
+    """
+    setup()
+    listener: QueueListener = QueueListener(log_queue, _handler)
+    listener.start()
+    return listener
+
+
+def install(log_queue, level: Optional[int] = None) -> None:
+    """Send this worker process's records to the parent over a queue.
+
+    Records are filtered by level here, before they are formatted or put on
+    the queue, and written out by the single listener in the parent.
+    """
+    if log_queue is None:
+        return
+    if level is not None:
+        logging.getLogger(ROOT).setLevel(level)
+    _swap(QueueHandler(log_queue))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+
+#  Upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS: List[float] = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+
+class Metrics(object):
+
+    """Counters, stage timers and a latency histogram for jobs and runs.
+
+    Counters cover request outcomes and bytes, stage timers accumulate wall
+    time spent in each part of a search and the histogram buckets request
+    latencies. Everything is plain numbers so a job's metrics can be handed
+    back from a worker as a dictionary and merged into the run totals.
+    """
+
+    def __init__(self) -> None:
+        """Start with everything empty."""
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.stages: Dict[str, float] = defaultdict(float)
+        self.buckets: List[int] = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum: float = 0
+        self.latency_count: int = 0
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        """Add the wall time of the wrapped block to a stage."""
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage] += time.perf_counter() - start
+
+    def observe(self, seconds: float) -> None:
+        """Record a single request latency."""
+        index: int = len(LATENCY_BUCKETS)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                index = i
+                break
+        self.buckets[index] += 1
+        self.latency_sum += seconds
+        self.latency_count += 1
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Estimate a latency percentile as its bucket's upper bound.
+
+        :returns: None without samples or when the percentile is past the
+        last bound, which keeps it valid JSON.
+        """
+        if not self.latency_count:
+            return None
+        target: float = fraction * self.latency_count
+        seen: int = 0
+        for i, count in enumerate(self.buckets[:-1]):
+            seen += count
+            if seen >= target:
+                return LATENCY_BUCKETS[i]
+        return None
+
+    def describe(self, fraction: float) -> str:
+        """Render a latency percentile for the logs."""
+        value: Optional[float] = self.percentile(fraction)
+        if value is not None:
+            return '%ss' % value
+        if self.latency_count:
+            return '>%ss' % LATENCY_BUCKETS[-1]
+        return 'n/a'
+
+    def rate(self, counter: str, stage: str = 'total') -> float:
+        """Get a counter per second of a stage's wall time."""
+        elapsed: float = self.stages.get(stage, 0)
+        return self.counters.get(counter, 0) / elapsed if elapsed else 0
+
+    def merge(self, other: Dict[str, Any]) -> None:
+        """Fold in metrics exported by another job."""
+        for name, value in other.get('counters', dict()).items():
+            self.counters[name] += value
+        for name, value in other.get('stages', dict()).items():
+            self.stages[name] += value
+        latency: Dict[str, Any] = other.get('latency', dict())
+        for i, count in enumerate(latency.get('buckets', list())):
+            self.buckets[i] += count
+        self.latency_sum += latency.get('sum', 0)
+        self.latency_count += latency.get('count', 0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Export the metrics as plain, JSON friendly values."""
+        return {
+            'counters': dict(self.counters),
+            'stages': {k: round(v, 6) for k, v in self.stages.items()},
+            'latency': {'buckets': list(self.buckets),
+                        'sum': round(self.latency_sum, 6),
+                        'count': self.latency_count,
+                        'p50': self.percentile(0.5),
+                        'p99': self.percentile(0.99)},
+            'pages_per_second': round(self.pages_per_second(), 3)
+        }
+
+    def pages_per_second(self) -> float:
+        """Get the parse rate over the run, or the job when not a run."""
+        return self.rate('pages_parsed',
+                         'run' if 'run' in self.stages else 'total')
+
+    def to_json(self) -> str:
+        """Render the metrics as a JSON summary."""
+        return json.dumps(self.to_dict(), indent=4)
+
+    def to_prometheus(self, prefix: str = 'frisbee') -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        lines: List[str] = list()
+
+        def family(name: str, kind: str, samples: List[str]) -> None:
+            if not samples:
+                return
+            lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+            lines.extend('%s_%s' % (prefix, sample) for sample in samples)
+
+        labelled: Dict[str, Dict[str, int]] = {'status': dict(),
+                                               'rejected': dict()}
+        plain: Dict[str, int] = dict()
+        for name, value in sorted(self.counters.items()):
+            kind: str = name.split('_', 1)[0]
+            if kind in labelled and '_' in name:
+                labelled[kind][name.split('_', 1)[1]] = value
+            else:
+                plain[name] = value
+        family('requests_total', 'counter',
+               ['requests_total{status="%s"} %d' % (k, v)
+                for k, v in labelled['status'].items()])
+        family('rejected_total', 'counter',
+               ['rejected_total{reason="%s"} %d' % (k, v)
+                for k, v in labelled['rejected'].items()])
+        for name, value in plain.items():
+            family(name + '_total', 'counter',
+                   ['%s_total %d' % (name, value)])
+        family('stage_seconds_total', 'counter',
+               ['stage_seconds_total{stage="%s"} %f' % (k, v)
+                for k, v in sorted(self.stages.items())])
+        samples: List[str] = list()
+        seen: int = 0
+        for bound, count in zip(LATENCY_BUCKETS + ['+Inf'], self.buckets):
+            seen += count
+            samples.append('request_latency_seconds_bucket{le="%s"} %d' %
+                           (bound, seen))
+        samples.append('request_latency_seconds_sum %f' % self.latency_sum)
+        samples.append('request_latency_seconds_count %d' %
+                       self.latency_count)
+        family('request_latency_seconds', 'histogram', samples)
+        family('pages_per_second', 'gauge',
+               ['pages_per_second %f' % self.pages_per_second()])
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+import functools
+import os
+from importlib import import_module
+from typing import Dict
+from typing import List
+
+
+#  Entry point group third-party packages register their engines under
+ENTRY_POINT_GROUP: str = 'frisbee.modules'
+#  Files in this folder that hold no engine
+NOT_ENGINES: List[str] = ['__init__', 'base']
+#  Engines registered in code, see `register`
+_REGISTERED: Dict[str, type] = dict()
+
+
+@functools.lru_cache(maxsize=1)
+def builtin_modules() -> Dict[str, str]:
+    """List the engines shipped in this folder by name and import path."""
+    folder: str = os.path.dirname(os.path.abspath(__file__))
+    names: List[str] = [f[:-3] for f in os.listdir(folder)
+                        if f.endswith('.py') and f[:-3] not in NOT_ENGINES]
+    return {name: '%s.%s' % (__name__, name) for name in sorted(names)}
+
+
+@functools.lru_cache(maxsize=1)
+def plugin_modules() -> Dict:
+    """List the engines other packages register, by name.
+
+    Reading installed package metadata is slow, so this only runs the first
+    time an engine is asked for that isn't shipped here.
+    """
+    from importlib.metadata import entry_points
+    try:
+        found = entry_points(group=ENTRY_POINT_GROUP)
+    except TypeError:  # Before Python 3.10
+        found = entry_points().get(ENTRY_POINT_GROUP, [])
+    return {entry.name: entry for entry in found}
+
+
+def register(name: str, module: type) -> None:
+    """Make an engine class available by name without packaging it.
+
+    Registrations are per process, so register before the executor starts
+    its workers for them to be seen there.
+    """
+    _REGISTERED[name] = module
+    get_module.cache_clear()
+
+
+def is_module(name: str) -> bool:
+    """Check whether an engine exists without importing it."""
+    return name in _REGISTERED or name in builtin_modules() or \
+        name in plugin_modules()
+
+
+@functools.lru_cache(maxsize=None)
+def get_module(name: str) -> type:
+    """Get the Module class of an engine, importing it once per process."""
+    if name in _REGISTERED:
+        return _REGISTERED[name]
+    if name in builtin_modules():
+        return getattr(import_module(builtin_modules()[name]), 'Module')
+    if name in plugin_modules():
+        return plugin_modules()[name].load()
+    raise Exception("Module %s is not valid" % name)
@@ -1,15 +1,34 @@
 #!/usr/bin/env python
+import functools
 import logging
-import requests
+import time
 import urllib3
-from requests_futures.sessions import FuturesSession
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from concurrent.futures import wait
+from frisbee import dedup
+from frisbee import limiter
+from frisbee.backends import MAX_BYTES
+from frisbee.backends import get_backend
+from frisbee.backends import tally
+from frisbee.cache import ResponseCache
+from frisbee.cache import get_cache
+from frisbee.dedup import PageRegistry
+from frisbee.metrics import Metrics
+from frisbee.policy import RequestPolicy
+from frisbee.policy import get_policy
+from frisbee.utils import PATTERN
 from frisbee.utils import clean_urls
 from frisbee.utils import gen_logger
-from frisbee.utils import gen_headers
 from typing import ClassVar
+from typing import Deque
 from typing import Dict
+from typing import Iterator
 from typing import List
+from typing import Optional
+from typing import Set
 
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -20,15 +39,59 @@ class Base(object):
     """Base module class to assist in writing new modules."""
 
     name: ClassVar[str] = 'base'
-    log: ClassVar[logging.Logger] = gen_logger(name, logging.DEBUG)
+    log: ClassVar[logging.Logger] = gen_logger(name)
     limit: ClassVar[int] = 500
+    #  Whether a job may carry several `domains` searched in one query
+    batchable: ClassVar[bool] = False
 
-    def __init__(self, log_level=logging.DEBUG) -> None:
+    def __init__(self, log_level=None, backend: str = 'futures',
+                 concurrency: Optional[int] = None, timeout: float = 7,
+                 pool: Optional[Dict] = None,
+                 max_bytes: int = MAX_BYTES, pipeline: bool = False,
+                 queue_size: int = 100, adaptive: bool = False,
+                 wave: int = 3, extractor: str = 'soup',
+                 cache: Optional[str] = None, cache_ttl: float = 86400,
+                 cache_max_bytes: int = 512 * 1024 * 1024,
+                 retries: int = 2, hedge: bool = False,
+                 adaptive_timeout: bool = True) -> None:
         """Local variables for the module."""
         self.set_log_level(log_level)
+        self.backend = get_backend(backend, concurrency=concurrency,
+                                   pool=pool)
+        self.timeout: float = timeout
+        self.max_bytes: int = max_bytes
+        self.policy: RequestPolicy = get_policy()
+        self.retries: int = max(retries, 0)
+        self.hedge: bool = hedge
+        self.adaptive_timeout: bool = adaptive_timeout
+        self.metrics: Metrics = Metrics()
+        self.stats: Dict[str, int] = self.metrics.counters
+        self.pipeline: bool = pipeline
+        self.queue_size: int = queue_size
+        self.adaptive: bool = adaptive
+        self.wave: int = max(wave, 1)
+        self.pages: int = 0
+        if extractor not in ['soup', 'fast']:
+            raise Exception("Extractor %s is not valid" % extractor)
+        self.extractor: str = extractor
+        self.cache: Optional[ResponseCache] = None
+        if cache:
+            self.cache = get_cache(cache, cache_ttl, cache_max_bytes)
+        self.registry: Optional[PageRegistry] = dedup.current()
+        self.hits: Set[str] = set()
+        #  Candidates per result page, only kept when pages are shared
+        self.page_hits: Optional[Dict[str, Set[str]]] = None
+        self.processed: int = 0
+        self._claimed: Set[str] = set()
 
     def set_log_level(self, level: str) -> None:
-        """Override the default log level of the class."""
+        """Override the default log level of the class.
+
+        Without a level the class follows the level configured for frisbee.
+        """
+        if level is None:
+            return
+        to_set = level
         if level == 'info':
             to_set = logging.INFO
         if level == 'debug':
@@ -37,28 +100,301 @@ class Base(object):
             to_set = logging.ERROR
         self.log.setLevel(to_set)
 
-    def _request_bulk(self, urls: List[str]) -> List:
-        """Batch the requests going out."""
+    def _request_bulk(self, urls: List[str], stage: str = 'page') -> List:
+        """Batch the requests going out, timed under the stage given."""
+        return list(self._iter_bulk(urls, stage))
+
+    def _iter_bulk(self, urls: List[str], stage: str = 'page') -> Iterator:
+        """Yield the responses for a batch as they arrive.
+
+        Cached responses come first, then fetched ones in completion order.
+        Only the time spent waiting on them counts toward the stage, not the
+        time the caller spends on each response.
+        """
         if not urls:
-            return list()
+            return
+        missing: List[str] = list()
+        for url in clean_urls(urls):
+            with self.metrics.time(stage + '_fetch'):
+                cached = self._cached(url)
+            if cached:
+                yield cached
+            else:
+                missing.append(url)
+        self.log.debug("Bulk requesting: %d", len(missing))
+        fetched: Iterator = self.backend.iter_fetch(
+            missing, self.timeout, self.max_bytes, self.stats,
+            limiter.current(), functools.partial(self._send, stage=stage))
+        while True:
+            with self.metrics.time(stage + '_fetch'):
+                response = next(fetched, None)
+                if response is None:
+                    break
+                self._store(response)
+            self._observe([response])
+            yield response
+        self.log.debug("Bulk requests completed")
+
+    def _observe(self, responses: List) -> None:
+        """Record the latency of responses that came off the network."""
+        for response in responses:
+            if not response.cached:
+                self.metrics.observe(response.elapsed)
+
+    def _cached(self, url: str):
+        """Look up a URL in the response cache, counting hits and misses."""
+        if not self.cache:
+            return None
+        response = self.cache.get(url)
+        self.stats['cache_hits' if response else 'cache_misses'] += 1
+        return response
+
+    def _store(self, response) -> None:
+        """Save a freshly fetched successful response to the cache."""
+        if not self.cache or response.cached or \
+                response.status_code != 200:
+            return
+        self.cache.put(response.request_url, response)
+
+    def _consume(self, response) -> None:
+        """Read a response and keep the candidate emails found in it.
+
+        Pages claimed in the shared registry have their candidates published
+        for other jobs as soon as they are read.
+        """
+        self.processed += 1
+        self.stats['pages_parsed'] += 1
+        with self.metrics.time('parse'):
+            text: Optional[str] = self._read(response)
+        with self.metrics.time('extract'):
+            hits: Set[str] = set(PATTERN.findall(text)) if text else set()
+            self.hits.update(hits)
+        if self.page_hits is not None:
+            self.page_hits[response.request_url] = hits
+        if response.request_url in self._claimed:
+            self._claimed.discard(response.request_url)
+            self.registry.publish(response.request_url, list(hits))
+
+    def _shares(self, response) -> bool:
+        """Check whether a response will be published to other jobs."""
+        return response.request_url in self._claimed
+
+    def _claim(self, url: str) -> Optional[bool]:
+        """Claim a result page in the shared registry.
+
+        :returns: True when this job should fetch the page, False when the
+        page was already read by another job and None when another job is
+        still fetching it.
+        """
+        if not self.registry:
+            return True
+        owned, hits = self.registry.claim(url)
+        if owned:
+            self._claimed.add(url)
+            return True
+        if hits is None:
+            return None
+        self._reuse(hits, url)
+        return False
+
+    def _reuse(self, hits: List[str], url: str) -> None:
+        """Take in candidates published by another job."""
+        self.stats['dedup_avoided'] += 1
+        self.processed += 1
+        self.hits.update(hits)
+        if self.page_hits is not None:
+            self.page_hits[url] = set(hits)
+
+    def _release(self) -> None:
+        """Publish empty results for claimed pages that never arrived."""
+        for url in self._claimed:
+            self.registry.publish(url, list())
+        self._claimed.clear()
+
+    def _resolve(self, urls: List[str]) -> List[str]:
+        """Wait on pages other jobs are fetching.
+
+        :returns: Pages that were still not published once the wait ran out
+        and should be fetched directly.
+        """
+        deadline: float = time.time() + self.timeout * 2
+        while urls:
+            remaining: List[str] = list()
+            for url in urls:
+                hits = self.registry.lookup(url)
+                if hits is None:
+                    remaining.append(url)
+                    continue
+                self._reuse(hits, url)
+            urls = remaining
+            if not urls or time.time() > deadline:
+                break
+            time.sleep(0.1)
+        return urls
+
+    def _collect(self, urls: List[str]) -> None:
+        """Fetch and read result pages, sharing them with other jobs."""
         urls = clean_urls(urls)
-        session: FuturesSession = FuturesSession()
-        self.log.debug("Bulk requesting: %d" % len(urls))
-        futures = [
-            session.get(u, headers=gen_headers(), timeout=7, verify=False)
-            for u in urls
-        ]
-        self.log.debug("Requests made")
-        done, _ = wait(futures)
-        results: List = list()
-        self.log.debug("Storing results")
-        for response in done:
-            try:
-                results.append(response.result())
-            except Exception as err:
-                self.log.warn("Failed result: %s" % err)
-        self.log.debug("Stored and returning")
-        return results
+        if not self.registry:
+            self._fetch(urls)
+            return
+        owned: List[str] = list()
+        deferred: List[str] = list()
+        for url in urls:
+            claim: Optional[bool] = self._claim(url)
+            if claim:
+                owned.append(url)
+            elif claim is None:
+                deferred.append(url)
+        try:
+            self._fetch(owned)
+        finally:
+            self._release()
+        self._fetch(self._resolve(deferred))
+
+    def _novel(self, responses: List, seen: Set[str]) -> List[List[str]]:
+        """Split SERP links into those not yet seen, one list per page."""
+        pages: List[List[str]] = list()
+        for response in responses:
+            links: List[str] = list()
+            with self.metrics.time('serp_parse'):
+                found: List[str] = clean_urls(self._process([response]))
+            response.release()
+            for url in found:
+                if url in seen:
+                    continue
+                seen.add(url)
+                links.append(url)
+            self.stats['serp_links'] += len(links)
+            pages.append(links)
+        return pages
+
+    def _paginate(self, urls: List[str]) -> List[str]:
+        """Fetch SERPs and return the result links they list.
+
+        With adaptive paging on, SERPs are fetched in waves of `wave` pages
+        and paging stops as soon as a page yields nothing new, which is
+        where most engines start repeating themselves for small domains.
+        """
+        step: int = self.wave if self.adaptive else max(len(urls), 1)
+        seen: Set[str] = set()
+        links: List[str] = list()
+        for i in range(0, len(urls), step):
+            batch: List[str] = urls[i:i + step]
+            self.pages += len(batch)
+            self.stats['serps'] += len(batch)
+            pages: List[List[str]] = self._novel(self._fetch(batch, 'serp'),
+                                                 seen)
+            for page in pages:
+                links.extend(page)
+            if self.adaptive and (len(pages) < len(batch) or
+                                  not all(pages)):
+                self.log.debug("Results exhausted after %d pages",
+                               self.pages)
+                break
+        return links
+
+    def _send(self, url: str, stage: str = 'page') -> Future:
+        """Start a request on the fetch backend under the request policy.
+
+        SERPs are idempotent and each one carries a batch of results, so
+        they are the requests retried.
+        """
+        return self.policy.submit(
+            self.backend, url, self.timeout, self.max_bytes,
+            limiter.current(), self.stats,
+            retries=self.retries if stage == 'serp' else 0, hedge=self.hedge,
+            adaptive=self.adaptive_timeout)
+
+    def _submit(self, url: str, stage: str = 'page') -> Future:
+        """Start a single request unless the cache can answer it."""
+        cached = self._cached(url)
+        if cached:
+            future: Future = Future()
+            future.set_result(cached)
+            return future
+        return self._send(url, stage)
+
+    def _stream(self, urls: List[str]) -> None:
+        """Run the search stages as a pipeline instead of in batches.
+
+        Each SERP has its result links queued for fetching as soon as it is
+        parsed and each page is read as soon as it arrives. Both stages are
+        capped at `queue_size` in-flight requests and SERPs stop being sent
+        while the link backlog is full, so a slow stage pushes back on the
+        one feeding it rather than letting work pile up. With adaptive
+        paging on, only `wave` SERPs are in flight at a time and paging stops
+        once a SERP yields no new links.
+        """
+        serps: Deque[str] = deque(clean_urls(urls))
+        links: Deque[str] = deque()
+        deferred: List[str] = list()
+        seen: Set[str] = set()
+        pending: Dict[Future, str] = dict()
+        inflight: Dict[str, int] = {'serp': 0, 'page': 0}
+        window: int = self.wave if self.adaptive else self.queue_size
+        self.log.debug("Streaming requests: %d", len(serps))
+        deadline: float = 0
+        while serps or links or pending or deferred:
+            while serps and len(links) < self.queue_size and \
+                    inflight['serp'] < window:
+                pending[self._submit(serps.popleft(), 'serp')] = 'serp'
+                inflight['serp'] += 1
+                self.pages += 1
+                self.stats['serps'] += 1
+            while links and inflight['page'] < self.queue_size:
+                url: str = links.popleft()
+                claim: Optional[bool] = self._claim(url)
+                if claim is None:
+                    deferred.append(url)
+                    deadline = time.time() + self.timeout * 2
+                if not claim:
+                    continue
+                pending[self._submit(url)] = 'page'
+                inflight['page'] += 1
+            if deferred and (not pending or time.time() > deadline):
+                for url in self._resolve(deferred):
+                    pending[self._submit(url)] = 'page'
+                    inflight['page'] += 1
+                deferred = list()
+                continue
+            with self.metrics.time('wait'):
+                done, _ = wait(pending, timeout=0.1 if deferred else None,
+                               return_when=FIRST_COMPLETED)
+            for future in done:
+                stage: str = pending.pop(future)
+                inflight[stage] -= 1
+                try:
+                    responses: List = tally([future.result()], self.stats)
+                except Exception as err:
+                    self.log.warning("Failed result: %r", err)
+                    continue
+                if not responses:
+                    continue
+                self._observe(responses)
+                self._store(responses[0])
+                self._consume(responses[0])
+                if stage != 'serp':
+                    continue
+                novel: List[str] = self._novel(responses, seen)[0]
+                links.extend(novel)
+                if self.adaptive and not novel and serps:
+                    self.log.debug("Results exhausted after %d pages",
+                                   self.pages)
+                    serps.clear()
+            if deferred:
+                deferred = [u for u in deferred if not self._reused(u)]
+        if self.registry:
+            self._release()
+        self.log.debug("Streaming completed")
+
+    def _reused(self, url: str) -> bool:
+        """Take in a deferred page if another job has published it."""
+        hits = self.registry.lookup(url)
+        if hits is None:
+            return False
+        self._reuse(hits, url)
+        return True
 
     def search(self) -> None:
         """Execute search function and hand to processor."""
@@ -80,12 +416,21 @@ class Base(object):
         """
         raise NotImplementedError
 
-    def _fetch(self, urls: List[str]) -> None:
+    def _fetch(self, urls: List[str], stage: str = 'page') -> None:
         """Perform bulk collection of data and return the content.
 
-        Gathering responses is handled by the base class and uses futures to
-        speed up the processing. Response data is saved inside a local variable
-        to be used later in extraction.
+        Gathering responses is handled by the base class and uses the selected
+        fetch backend to speed up the processing. Response data is saved
+        inside a local variable to be used later in extraction. The stage
+        names what is being fetched, either SERPs or result pages.
+        """
+        raise NotImplementedError
+
+    def _read(self, response) -> Optional[str]:
+        """Convert a single response into text for extraction.
+
+        Responses are handed over one at a time as they arrive. Returning
+        None skips the response.
         """
         raise NotImplementedError
 
@@ -96,3 +441,45 @@ class Base(object):
         extractor. Data is cleaned prior to running pattern expressions.
         """
         raise NotImplementedError
+
+
+def fan_out(engines: Dict[str, Base]) -> Dict:
+    """Search one domain through several engines sharing the result pages.
+
+    SERP stages run at once, one thread per engine. The result links they
+    list are merged and every page is fetched and read a single time by the
+    first engine, so each extra engine only costs its SERP requests. Emails
+    are then matched per engine from the SERPs it fetched and the pages it
+    listed. Stages run as batches, pipelining is not used here.
+
+    :returns: Results shaped like a single engine's, with the emails found
+    by each engine under `engines`.
+    """
+    modules: List[Base] = list(engines.values())
+    lead: Base = modules[0]
+    metrics: Metrics = Metrics()
+    with metrics.time('total'):
+        with ThreadPoolExecutor(max_workers=len(modules)) as pool:
+            listed: List[List[str]] = list(pool.map(
+                lambda m: m._paginate(m._format()), modules))
+        sources: Dict[str, List[Base]] = dict()
+        for module, links in zip(modules, listed):
+            for url in clean_urls(links):
+                sources.setdefault(url, list()).append(module)
+        serp_hits: List[Set[str]] = [set(m.hits) for m in modules]
+        lead.page_hits = dict()
+        lead._collect(list(sources))
+        for module, hits in zip(modules, serp_hits):
+            module.hits = hits
+        for url, hits in lead.page_hits.items():
+            for module in sources.get(url, list()):
+                module.hits.update(hits)
+        lead.page_hits = None
+        found: Dict[str, List[str]] = {name: module._extract()
+                                       for name, module in engines.items()}
+    for module in modules:
+        metrics.merge(module.metrics.to_dict())
+    return {'emails': sorted(set().union(*found.values())), 'engines': found,
+            'processed': sum(m.processed for m in modules),
+            'pages': sum(m.pages for m in modules),
+            'metrics': metrics.to_dict()}
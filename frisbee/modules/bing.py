@@ -1,27 +1,37 @@
 #!/usr/bin/env python
+import itertools
 from bs4 import BeautifulSoup
 from frisbee.modules.base import Base
-from frisbee.utils import extract_emails
+from frisbee.utils import get_matcher
+from frisbee.utils import has_candidates
+from frisbee.utils import html_to_text
 
 
 class Module(Base):
 
     """Custom search module."""
 
+    batchable = True
+
     def __init__(self, domain=None, modifier=None, engine="bing", greedy=False,
-                 fuzzy=False, limit=500):
-        """Setup the primary client instance."""
-        super(Base, self).__init__()
+                 fuzzy=False, limit=500, host="https://www.bing.com",
+                 domains=None, **kwargs):
+        """Setup the primary client instance.
+
+        Passing several `domains` searches them all with a single OR query,
+        the emails found are then split back per domain.
+        """
+        super(Module, self).__init__(**kwargs)
         self.name = "Bing"
-        self.host = "https://www.bing.com"
-        self.domain = domain
+        self.host = host
+        self.domains = list(domains or [domain])
+        self.domain = domain or self.domains[0]
         self.modifier = modifier
         self.limit = limit
         self.greedy = greedy
         self.fuzzy = fuzzy
 
         self.results = list()
-        self.data = list()
 
         self._start_time = None
         self._end_time = None
@@ -35,8 +45,11 @@ class Module(Base):
         """
         self.log.debug("Formatting URLs to request")
         items = list()
+        terms = ' OR '.join('"%s"' % d for d in self.domains)
+        if len(self.domains) > 1:
+            terms = '(%s)' % terms
         for i in range(0, self.limit, 10):
-            query = '"%s" %s' % (self.domain, self.modifier)
+            query = '%s %s' % (terms, self.modifier)
             url = self.host + "/search?q=" + query + "&first=" + str(i)
             items.append(url)
         self.log.debug("URLs were generated")
@@ -52,8 +65,7 @@ class Module(Base):
         items = list()
         for response in responses:
             try:
-                soup = BeautifulSoup(response.content, 'html.parser',
-                                     from_encoding="iso-8859-1")
+                soup = BeautifulSoup(response.text, 'html.parser')
             except:
                 continue
             else:
@@ -62,51 +74,79 @@ class Module(Base):
         self.log.debug("Search result URLs were extracted")
         return items
 
-    def _fetch(self, urls):
+    def _fetch(self, urls, stage='page'):
         """Perform bulk collection of data and return the content.
 
-        Gathering responses is handled by the base class and uses futures to
-        speed up the processing. Response data is saved inside a local variable
-        to be used later in extraction.
+        Gathering responses is handled by the base class and uses the selected
+        fetch backend to speed up the processing. Each response has its
+        candidate emails kept as soon as it arrives and is then let go, only
+        SERPs are returned so their listings can be followed.
         """
-        responses = self._request_bulk(urls)
-        self.log.debug("Converting responses to text")
-        for response in responses:
-            if len(response.content) > 3000000:
-                continue
-            try:
-                soup = BeautifulSoup(response.content, 'html.parser',
-                                     from_encoding="iso-8859-1")
-                text = soup.get_text()  # This will result in errors at times as it smashes text together with the email address
-            except Exception:
-                text = response.text
-            self.data.append(text) # Opportunistic findings
+        responses = list()
+        for response in self._iter_bulk(urls, stage):
+            self._consume(response)  # Opportunistic findings
+            if stage == 'serp':
+                responses.append(response)
         self.log.debug("Responses converted")
         return responses
 
+    def _read(self, response):
+        """Convert a single response into text for extraction."""
+        if self.extractor == 'fast':
+            needle = self.domain.split('.')[0] if self.fuzzy else self.domain
+            if self._shares(response) or len(self.domains) > 1:
+                needle = ''  # Other domains may be after this page
+            if not has_candidates(response.content, needle):
+                self.stats['skipped'] += 1
+                return None
+            return html_to_text(response.text)
+        text = response.text
+        try:
+            soup = BeautifulSoup(text, 'html.parser')
+            text = soup.get_text()  # This will result in errors at times as it smashes text together with the email address
+        except Exception:
+            pass
+        return text
+
     def _extract(self):
         """Extract email addresses from results.
 
-        Text content from all crawled pages are ran through a simple email
-        extractor. Data is cleaned prior to running pattern expressions.
+        Candidate emails from all crawled pages are ran through a simple
+        email matcher. Data is cleaned prior to running pattern expressions.
         """
         self.log.debug("Extracting emails from text content")
-        for item in self.data:
-            emails = extract_emails(item, self.domain, self.fuzzy)
-            self.results.extend(emails)
+        self.results.extend(self._match()[self.domain])
         self.log.debug("Email extraction completed")
         return list(set(self.results))
 
+    def _match(self):
+        """Bucket the candidate emails by the domain they belong to."""
+        with self.metrics.time('match'):
+            matcher = get_matcher(tuple(self.domains), self.fuzzy)
+            return matcher.match_hits(self.hits)
+
     def search(self):
         """Run the full search process.
 
         Simple public method to abstract the steps needed to produce a full
         search using the engine.
         """
-        requests = self._format()
-        serps = self._fetch(requests)
-        urls = self._process(serps)
-        details = self._fetch(urls)
-        emails = self._extract()
+        with self.metrics.time('total'):
+            requests = self._format()
+            if self.pipeline:
+                self._stream(requests)
+            else:
+                urls = self._paginate(requests)
+                self._collect(urls)
+            if len(self.domains) > 1:
+                found = {d: sorted(set(e)) for d, e in self._match().items()}
+                emails = sorted(set(itertools.chain(*found.values())))
+            else:
+                found = None
+                emails = self._extract()
         self.log.debug("Job completed")
-        return {'emails': emails, 'processed': len(self.data)}
+        results = {'emails': emails, 'processed': self.processed,
+                   'pages': self.pages, 'metrics': self.metrics.to_dict()}
+        if found is not None:
+            results['domains'] = found
+        return results
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from collections import deque
+from concurrent.futures import CancelledError
+from concurrent.futures import Future
+from typing import Any
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from urllib.parse import urlparse
+from frisbee.utils import gen_logger
+
+
+LOG: logging.Logger = gen_logger('policy')
+#  Latencies kept per host and the samples needed before they are trusted
+WINDOW: int = 64
+MIN_SAMPLES: int = 10
+#  Adaptive timeouts are this many times the host's p99, never below floor
+TIMEOUT_FACTOR: float = 4
+TIMEOUT_FLOOR: float = 1
+#  Base and cap in seconds of the jittered exponential retry backoff
+BACKOFF: float = 0.25
+BACKOFF_CAP: float = 4
+#  Share of requests that may be hedged
+HEDGE_BUDGET: float = 0.1
+RETRY_STATUSES: List[int] = [429, 500, 502, 503, 504]
+
+
+class _Timers(object):
+
+    """Single daemon thread running delayed calls in due order."""
+
+    def __init__(self) -> None:
+        """Start the timer thread."""
+        self._heap: List[Tuple[float, int, Callable]] = list()
+        self._ids = itertools.count()
+        self._cond: threading.Condition = threading.Condition()
+        self._thread: threading.Thread = threading.Thread(target=self._run,
+                                                          daemon=True)
+        self._thread.start()
+
+    def schedule(self, delay: float, call: Callable) -> None:
+        """Run a call once the delay has passed."""
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay,
+                                        next(self._ids), call))
+            self._cond.notify()
+
+    def _run(self) -> None:
+        """Wait for the next due call and run it."""
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                due: float = self._heap[0][0] - time.monotonic()
+                if due > 0:
+                    self._cond.wait(due)
+                    continue
+                call: Callable = heapq.heappop(self._heap)[2]
+            try:
+                call()
+            except Exception as err:
+                LOG.warning("Delayed call failed: %r", err)
+
+
+class RequestPolicy(object):
+
+    """Latency-aware timeouts, retries and hedging on top of a backend.
+
+    Latencies are tracked per host over a rolling window. Once a host has
+    enough samples its timeout shrinks to a multiple of its p99, so one slow
+    request can't hold a batch for the full configured timeout, which stays
+    the ceiling. Failed or throttled requests may be retried after a
+    jittered exponential backoff and a request still running past its
+    host's p95, counted from when the backend actually started it, may be
+    hedged with a duplicate while the backend has a free slot for it, the
+    first answer wins.
+    Requests are wrapped in a future so callers see a single response.
+    """
+
+    def __init__(self) -> None:
+        """Start with no latency history."""
+        self._latency: Dict[str, Deque[float]] = defaultdict(
+            lambda: deque(maxlen=WINDOW))
+        self._lock: threading.Lock = threading.Lock()
+        self._timers: Optional[_Timers] = None
+        self._sent: int = 0
+        self._hedged: int = 0
+
+    def observe(self, host: str, seconds: float) -> None:
+        """Record how long a request to the host took."""
+        with self._lock:
+            self._latency[host].append(seconds)
+
+    def quantile(self, host: str, fraction: float) -> Optional[float]:
+        """Get a latency quantile for a host, None without enough samples."""
+        with self._lock:
+            samples: List[float] = sorted(self._latency.get(host, ()))
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return samples[min(int(fraction * len(samples)), len(samples) - 1)]
+
+    def timeout_for(self, host: str, ceiling: float) -> float:
+        """Derive the timeout of a request to the host."""
+        p99: Optional[float] = self.quantile(host, 0.99)
+        if p99 is None:
+            return ceiling
+        return min(max(p99 * TIMEOUT_FACTOR, TIMEOUT_FLOOR), ceiling)
+
+    def _count(self, stats: Optional[Dict[str, int]], name: str) -> None:
+        """Bump a counter of the job the request belongs to."""
+        if stats is not None:
+            with self._lock:
+                stats[name] += 1
+
+    def _schedule(self, delay: float, call: Callable) -> None:
+        """Run a call later on the timer thread."""
+        if not self._timers:
+            with self._lock:
+                if not self._timers:
+                    self._timers = _Timers()
+        self._timers.schedule(delay, call)
+
+    def submit(self, backend, url: str, timeout: float, max_bytes: int,
+               limiter=None, stats: Optional[Dict[str, int]] = None,
+               retries: int = 0, hedge: bool = False,
+               adaptive: bool = True) -> Future:
+        """Start a request on the backend under the policy.
+
+        Retries cover exceptions and throttled or failing statuses, so they
+        should only be asked for on idempotent requests.
+
+        :returns: Future resolving to the first usable response.
+        """
+        if not (adaptive or retries or hedge):
+            return backend.submit(url, timeout, max_bytes, limiter)
+        host: str = urlparse(url).hostname or ''
+        result: Future = Future()
+        #  Reentrant as cancelling the losing request runs its callback
+        lock: threading.RLock = threading.RLock()
+        live: Set[Future] = set()
+        state: Dict[str, Any] = {'attempt': 0, 'hedged': False}
+
+        def launch() -> None:
+            if result.done():
+                return
+            limit: float = self.timeout_for(host, timeout) if adaptive \
+                else timeout
+            with self._lock:
+                self._sent += 1
+            try:
+                future: Future = backend.submit(url, limit, max_bytes,
+                                                limiter)
+            except Exception as err:
+                with lock:
+                    if not result.done() and not live:
+                        result.set_exception(err)
+                return
+            with lock:
+                live.add(future)
+            future.add_done_callback(lambda f: finish(f, limit))
+
+        def retry() -> bool:
+            if state['attempt'] >= retries:
+                return False
+            state['attempt'] += 1
+            self._count(stats, 'retries')
+            self._schedule(random.uniform(0, min(
+                BACKOFF_CAP, BACKOFF * 2 ** state['attempt'])), launch)
+            return True
+
+        def finish(future: Future, limit: float) -> None:
+            with lock:
+                live.discard(future)
+                if result.done():
+                    return
+                try:
+                    response = future.result()
+                except CancelledError:
+                    return
+                except Exception as err:
+                    if isinstance(err, backend.timeouts):
+                        self._count(stats, 'timeouts')
+                        self.observe(host, limit)
+                    if live or retry():
+                        return
+                    result.set_exception(err)
+                    return
+                self.observe(host, response.elapsed)
+                if response.status_code in RETRY_STATUSES and not live \
+                        and retry():
+                    return
+                for other in list(live):
+                    other.cancel()
+                if state['hedged'] and state['first'] is not future:
+                    self._count(stats, 'hedge_wins')
+                result.set_result(response)
+
+        def duplicate(after: float) -> None:
+            with lock:
+                if result.done() or state['hedged'] or not live:
+                    return
+                starts: List[float] = [backend.started(f) for f in live]
+                starts = [start for start in starts if start is not None]
+                #  Time spent queued behind other requests doesn't count
+                waited: float = time.perf_counter() - min(starts) \
+                    if starts else 0
+                if waited < after:
+                    self._schedule(after - waited, lambda: duplicate(after))
+                    return
+                if backend.busy():
+                    #  A duplicate would queue behind the backend's requests
+                    self._schedule(after, lambda: duplicate(after))
+                    return
+                with self._lock:
+                    if self._hedged >= HEDGE_BUDGET * self._sent:
+                        return
+                    self._hedged += 1
+                state['hedged'] = True
+                state['first'] = next(iter(live))
+            self._count(stats, 'hedges')
+            launch()
+
+        launch()
+        if hedge:
+            after: Optional[float] = self.quantile(host, 0.95)
+            if after is not None:
+                self._schedule(after, lambda: duplicate(after))
+        return result
+
+
+_POLICY: Optional[RequestPolicy] = None
+_POLICY_PID: int = os.getpid()
+
+
+def get_policy() -> RequestPolicy:
+    """Get the request policy shared by every job in this process.
+
+    Latency history builds up across jobs, so later jobs start with timeouts
+    and hedging thresholds already tuned to the hosts seen so far.
+    """
+    global _POLICY, _POLICY_PID
+    if _POLICY is None or _POLICY_PID != os.getpid():
+        #  Timer threads don't survive a fork, start over in the child
+        _POLICY = RequestPolicy()
+        _POLICY_PID = os.getpid()
+    return _POLICY
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+import json
+import os
+import random
+import sqlite3
+from typing import Any
+from typing import ClassVar
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+
+
+class Sink(object):
+
+    """Destination for finished jobs.
+
+    Sinks receive each job as it completes and may buffer writes, so they
+    must be flushed once a run ends to write out what is left.
+    """
+
+    name: ClassVar[str] = 'base'
+
+    @property
+    def buffered(self) -> int:
+        """Number of jobs written but not yet flushed."""
+        return 0
+
+    def write(self, job: Dict[str, Any]) -> None:
+        """Record a finished job."""
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """Write out anything buffered."""
+        pass
+
+    def close(self) -> None:
+        """Flush anything buffered and release the destination."""
+        self.flush()
+
+
+class FileSink(Sink):
+
+    """Original layout of a job JSON and emails text file per domain."""
+
+    name: ClassVar[str] = 'files'
+
+    def __init__(self, folder: str) -> None:
+        """Setup the results folder."""
+        self.folder: str = folder
+        self.saved: Set[str] = set()
+
+    def write(self, job: Dict[str, Any]) -> None:
+        """Write the job details and its emails to their own files."""
+        if job['domain'] in self.saved:
+            return
+        path: str = os.path.join(self.folder, job['project'])
+        os.makedirs(path, exist_ok=True)
+        jid: int = random.randint(100000, 999999)
+        prefix: str = "%s/%s_%s_%d" % (path, job['project'], job['domain'],
+                                       jid)
+        with open(prefix + "_job.json", 'w') as handle:
+            handle.write(json.dumps(job, indent=4))
+        with open(prefix + "_emails.txt", 'w') as handle:
+            for email in job['results']['emails']:
+                handle.write(email + "\n")
+        self.saved.add(job['domain'])
+
+
+class JSONLSink(Sink):
+
+    """Append-only file holding one JSON job per line across runs."""
+
+    name: ClassVar[str] = 'jsonl'
+
+    def __init__(self, folder: str, buffer_size: int = 100) -> None:
+        """Open the shared results file for appending."""
+        self.path: str = os.path.join(folder, 'results.jsonl')
+        self.buffer_size: int = buffer_size
+        self._buffer: List[str] = list()
+        self._handle = open(self.path, 'a')
+
+    @property
+    def buffered(self) -> int:
+        """Number of jobs written but not yet flushed."""
+        return len(self._buffer)
+
+    def write(self, job: Dict[str, Any]) -> None:
+        """Buffer the job as a single line."""
+        self._buffer.append(json.dumps(job, separators=(',', ':')))
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write buffered lines out to disk."""
+        if not self._buffer:
+            return
+        self._handle.write('\n'.join(self._buffer) + '\n')
+        self._handle.flush()
+        self._buffer = list()
+
+    def close(self) -> None:
+        """Flush and close the results file."""
+        self.flush()
+        self._handle.close()
+
+
+class SQLiteSink(Sink):
+
+    """SQLite database of jobs and emails shared across runs.
+
+    Jobs are inserted in batched transactions. Emails are stored once per
+    project and domain and indexed on domain, email and project so results
+    from every run can be queried and deduplicated.
+    """
+
+    name: ClassVar[str] = 'sqlite'
+    SCHEMA: ClassVar[List[str]] = [
+        'CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, '
+        'project TEXT, domain TEXT, engine TEXT, modifier TEXT, '
+        'start_time TEXT, end_time TEXT, duration TEXT, details TEXT)',
+        'CREATE TABLE IF NOT EXISTS emails (project TEXT, domain TEXT, '
+        'email TEXT, UNIQUE (project, domain, email))',
+        'CREATE INDEX IF NOT EXISTS jobs_domain ON jobs (domain)',
+        'CREATE INDEX IF NOT EXISTS jobs_project ON jobs (project)',
+        'CREATE INDEX IF NOT EXISTS emails_domain ON emails (domain)',
+        'CREATE INDEX IF NOT EXISTS emails_email ON emails (email)',
+        'CREATE INDEX IF NOT EXISTS emails_project ON emails (project)',
+    ]
+
+    def __init__(self, folder: str, batch_size: int = 100,
+                 path: Optional[str] = None) -> None:
+        """Open the database and make sure the schema exists."""
+        self.path: str = path or os.path.join(folder, 'frisbee.db')
+        self.batch_size: int = batch_size
+        self._jobs: List = list()
+        self._emails: List = list()
+        self._conn: sqlite3.Connection = sqlite3.connect(self.path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._conn:
+            for statement in self.SCHEMA:
+                self._conn.execute(statement)
+
+    @property
+    def buffered(self) -> int:
+        """Number of jobs written but not yet flushed."""
+        return len(self._jobs)
+
+    def write(self, job: Dict[str, Any]) -> None:
+        """Queue the job and its emails for the next batch."""
+        engine: str = ','.join(job['engine']) \
+            if isinstance(job['engine'], list) else job['engine']
+        self._jobs.append((
+            job['project'], job['domain'], engine, job['modifier'],
+            job['start_time'], job['end_time'], job['duration'],
+            json.dumps(job, separators=(',', ':'))))
+        for email in job['results']['emails']:
+            self._emails.append((job['project'], job['domain'], email))
+        if len(self._jobs) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Insert queued rows in a single transaction."""
+        if not self._jobs:
+            return
+        with self._conn:
+            self._conn.executemany(
+                'INSERT INTO jobs (project, domain, engine, modifier, '
+                'start_time, end_time, duration, details) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', self._jobs)
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO emails (project, domain, email) '
+                'VALUES (?, ?, ?)', self._emails)
+        self._jobs = list()
+        self._emails = list()
+
+    def emails(self, domain: str, project: Optional[str] = None) -> List[str]:
+        """Get the distinct emails found for a domain across runs."""
+        self.flush()
+        query: str = 'SELECT DISTINCT email FROM emails WHERE domain = ?'
+        params: List[str] = [domain]
+        if project:
+            query += ' AND project = ?'
+            params.append(project)
+        rows = self._conn.execute(query + ' ORDER BY email', params)
+        return [row[0] for row in rows]
+
+    def close(self) -> None:
+        """Flush and close the database."""
+        self.flush()
+        self._conn.close()
+
+
+SINKS: Dict[str, type] = {
+    FileSink.name: FileSink,
+    JSONLSink.name: JSONLSink,
+    SQLiteSink.name: SQLiteSink,
+}
+
+
+def get_sink(name: str, folder: str) -> Sink:
+    """Create the sink identified by name writing under a results folder."""
+    if name not in SINKS:
+        raise Exception("Sink %s is not valid" % name)
+    os.makedirs(folder, exist_ok=True)
+    return SINKS[name](folder)
@@ -1,33 +1,70 @@
 #!/usr/bin/env python
+import codecs
 import datetime
+import functools
+import html
 import logging
 import os
 import random
 import re
-import sys
 from typing import Dict
+from typing import Iterable
 from typing import List
+from typing import Optional
 from typing import Pattern
+from typing import Set
+from typing import Tuple
+from typing import Union
+from urllib.parse import unquote
+from frisbee import logs
 
 
 EXTENSIONS = ['pdf', 'doc', 'docx', 'ppt', 'pptx', 'png', 'jpg', 'tiff', 'gif',
               'jpeg', 'psd', 'eps', 'raw', 'zip', 'exe', 'dmg', 'tar', 'tgz',
               'iso', 'rar', 'rpm', 'bin', 'jar', 'xls', 'xlsx']
 PATTERN: Pattern = re.compile(r'([\w.-]+@[\w.-]+)', re.IGNORECASE)
+#  Markup dropped or unwrapped by the fast extractor, mirroring get_text()
+MARKUP: Pattern = re.compile(
+    r'<!--.*?(?:-->|$)'
+    r'|<!\[CDATA\[(.*?)(?:\]\]>|$)'
+    r'|<(script|style|template)\b[^>]*>.*?(?:</\2\s*>|$)'
+    r'|<[!?][^>]*>'
+    r'|</?[a-zA-Z](?:[^>"\']|"[^"]*"|\'[^\']*\')*>',
+    re.IGNORECASE | re.DOTALL)
+MAILTO: Pattern = re.compile(r'mailto:([^"\'<>\s?]+)', re.IGNORECASE)
+#  An at-sign in raw content, plain or as a character reference
+AT_SIGN: Pattern = re.compile(
+    rb'@|&#0*64(?![0-9])|&#[xX]0*40(?![0-9a-fA-F])|&commat;|%40')
+#  References that can spell out the characters of a domain
+DOMAIN_REFS: Pattern = re.compile(rb'&#|&period;')
+CHARSET: Pattern = re.compile(r'charset\s*=\s*["\']?\s*([\w.:-]+)',
+                              re.IGNORECASE)
+META_CHARSET: Pattern = re.compile(
+    rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', re.IGNORECASE)
+#  Bytes of a page searched for a <meta> charset declaration
+SNIFF_BYTES: int = 4096
+BOMS: List[Tuple[bytes, str]] = [(codecs.BOM_UTF8, 'utf-8-sig'),
+                                 (codecs.BOM_UTF16_LE, 'utf-16-le'),
+                                 (codecs.BOM_UTF16_BE, 'utf-16-be')]
+#  Labels browsers decode with a superset, per the WHATWG encoding standard
+SUPERSETS: Dict[str, str] = {'ascii': 'cp1252', 'iso8859-1': 'cp1252',
+                             'iso8859-9': 'cp1254', 'gb2312': 'gb18030',
+                             'gbk': 'gb18030', 'euc_kr': 'cp949'}
 
 
-def gen_logger(name: str, log_level: int=logging.INFO) -> logging.Logger:
+def gen_logger(name: str, log_level: Optional[int] = None) -> logging.Logger:
     """Create a logger to be used between processes.
 
+    Loggers live under the frisbee namespace and share its single handler,
+    so asking for one repeatedly never duplicates output. Without a level
+    they follow the level configured for the namespace.
+
     :returns: Logging instance.
     """
-    logger = logging.getLogger(name)
-    logger.setLevel(log_level)
-    shandler: logging.StreamHandler = logging.StreamHandler(sys.stdout)
-    fmt: str = '\033[1;32m%(levelname)-5s %(module)s:%(funcName)s():'
-    fmt += '%(lineno)d %(asctime)s\033[0m| %(message)s'
-    shandler.setFormatter(logging.Formatter(fmt))
-    logger.addHandler(shandler)
+    logger = logging.getLogger('%s.%s' % (logs.ROOT, name))
+    if log_level is not None:
+        logger.setLevel(log_level)
+    logs.setup()
     return logger
 
 
@@ -48,23 +85,185 @@ def now_time() -> datetime.datetime:
     return datetime.datetime.now()
 
 
+class EmailMatcher(object):
+
+    """Match emails for many domains in a single pass over the text.
+
+    Domains (or their fuzzy seeds) are compiled into one overlapping search
+    so each candidate email is only scanned once no matter how many domains
+    are in play. Matching follows `extract_emails`: exact mode keeps hits
+    containing the domain and cuts them right after it, fuzzy mode keeps hits
+    whose host contains the first label of the domain.
+    """
+
+    def __init__(self, domains: Iterable[str], fuzzy: bool = False) -> None:
+        """Compile the combined expression for the domains."""
+        self.domains: Tuple[str, ...] = tuple(dict.fromkeys(domains))
+        self.fuzzy: bool = fuzzy
+        self._owners: Dict[str, List[str]] = dict()
+        for domain in self.domains:
+            needle: str = domain.split('.')[0] if fuzzy else domain
+            self._owners.setdefault(needle, list()).append(domain)
+        needles: List[str] = sorted([n for n in self._owners if n],
+                                    key=len, reverse=True)
+        self._always: List[str] = self._owners.get('', list())
+        self._search: Optional[Pattern] = None
+        if needles:
+            self._search = re.compile(
+                '(?=(%s))' % '|'.join(re.escape(n) for n in needles))
+        #  A hit on the longest needle at a position implies its prefixes
+        self._implied: Dict[str, List[str]] = {
+            n: [m for m in needles if n.startswith(m)] for n in needles
+        }
+
+    def _owned(self, value: str) -> List[str]:
+        """Get the domains whose needle appears in the value."""
+        if not self._search:
+            return self._always
+        if len(self._implied) == 1:
+            for needle, owners in self._owners.items():
+                if needle and needle in value:
+                    return self._always + owners
+            return self._always
+        found: Set[str] = set()
+        for match in self._search.finditer(value):
+            found.update(self._implied[match.group(1)])
+        owned: List[str] = list(self._always)
+        for needle in found:
+            owned.extend(self._owners[needle])
+        return owned
+
+    def candidates(self, text: str) -> Set[str]:
+        """Grab every email-like string from the text."""
+        return set(PATTERN.findall(text))
+
+    def match_hits(self, hits: Iterable[str]) -> Dict[str, List[str]]:
+        """Bucket already extracted candidates by the domain they match."""
+        buckets: Dict[str, Set[str]] = {d: set() for d in self.domains}
+        for hit in hits:
+            if self.fuzzy:
+                for domain in self._owned(hit.split('@')[1]):
+                    buckets[domain].add(hit.lower().strip('.'))
+                continue
+            lowered: str = hit.lower()
+            for domain in self._owned(hit):
+                buckets[domain].add(
+                    lowered[:lowered.find(domain) + len(domain)])
+        return {d: list(emails) for d, emails in buckets.items()}
+
+    def match(self, text: str) -> Dict[str, List[str]]:
+        """Grab emails from the text bucketed by domain."""
+        return self.match_hits(self.candidates(text))
+
+
+@functools.lru_cache(maxsize=256)
+def get_matcher(domains: Tuple[str, ...], fuzzy: bool) -> EmailMatcher:
+    """Get a cached matcher for a set of domains."""
+    return EmailMatcher(domains, fuzzy)
+
+
 def extract_emails(results: str, domain: str, fuzzy: bool) -> List[str]:
     """Grab email addresses from raw text data."""
-    hits = list()
-    for match in PATTERN.finditer(results):
-        hits.append(tuple(match.groups())[0])
-    hits = list(set(hits))
-    if fuzzy:
-        seed = domain.split('.')[0]
-        emails: List[str] = [x.lower().strip('.') for x in hits if x.split('@')[1].__contains__(seed)]
-    else:
-        emails = list()
-        for match in hits:
-            if domain not in match:
-                continue
-            match = match.lower()
-            emails.append(match[:match.find(domain) + len(domain)])
-    return emails
+    return get_matcher((domain,), fuzzy).match(results)[domain]
+
+
+def has_candidates(content: bytes, needle: str) -> bool:
+    """Cheaply check raw content could hold an email for the needle.
+
+    Pages without any form of an at-sign or without the domain (or fuzzy
+    seed) anywhere in them can't produce a match and are not worth decoding.
+    A domain hidden behind character references is looked for in the
+    unescaped page, UTF-16 pages can't be checked as bytes and always pass.
+    """
+    if content.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return True
+    if not AT_SIGN.search(content):
+        return False
+    if needle.encode('utf-8', 'ignore') in content:
+        return True
+    if not DOMAIN_REFS.search(content):
+        return False
+    return needle in html.unescape(content.decode('latin-1'))
+
+
+def _codec(label: Optional[str]) -> Optional[str]:
+    """Normalize a declared charset to a text codec name, None if unknown.
+
+    Codecs that aren't text encodings (hex, base64) or that can't replace
+    bad bytes (idna) are refused like unknown labels.
+    """
+    if not label:
+        return None
+    try:
+        name: str = codecs.lookup(label.strip().lower()).name
+        b'<'.decode(name, errors='replace')  # Raises for non-text codecs
+    except (LookupError, ValueError):
+        return None
+    return SUPERSETS.get(name, name)
+
+
+def sniff_charset(content: bytes, content_type: str = '') -> Optional[str]:
+    """Find the charset a page declares.
+
+    A byte order mark wins, then the charset of the Content-Type header and
+    then a <meta> charset within the first few KB of the page.
+
+    :returns: Codec name or None when nothing usable is declared.
+    """
+    for bom, name in BOMS:
+        if content.startswith(bom):
+            return name
+    found = CHARSET.search(content_type)
+    charset: Optional[str] = _codec(found.group(1)) if found else None
+    if charset:
+        return charset
+    found = META_CHARSET.search(content, 0, SNIFF_BYTES)
+    charset = _codec(found.group(1).decode('ascii')) if found else None
+    if charset and charset.startswith('utf-16'):
+        return 'utf-8'  # Declared in ASCII, so the page can't really be
+    return charset
+
+
+def decode_html(content: bytes, content_type: str = '',
+                charset: Optional[str] = None) -> Tuple[str, str]:
+    """Decode a page once using its declared or likely charset.
+
+    Undeclared pages are taken as UTF-8 when they are valid UTF-8 and as
+    windows-1252 otherwise, which is what browsers fall back on and avoids
+    statistical detection over the whole body.
+
+    :returns: Text and the codec it was decoded with.
+    """
+    charset = _codec(charset) or sniff_charset(content, content_type)
+    if charset:
+        try:
+            return content.decode(charset, errors='replace'), charset
+        except (LookupError, ValueError):
+            pass  # Codecs like punycode still fail on some input
+    try:
+        return content.decode('utf-8'), 'utf-8'
+    except UnicodeDecodeError:
+        return content.decode('cp1252', errors='replace'), 'cp1252'
+
+
+def html_to_text(content: Union[bytes, str],
+                 encoding: Optional[str] = None) -> str:
+    """Strip markup from a page without building a document tree.
+
+    Output follows BeautifulSoup's get_text(): comments, declarations and
+    script, style and template bodies are dropped, CDATA is kept and tags are
+    removed without adding whitespace. Addresses from mailto: links are
+    decoded and appended as they often only live in the markup.
+    """
+    if isinstance(content, bytes):
+        content = decode_html(content, charset=encoding)[0]
+    text: str = MARKUP.sub(lambda m: m.group(1) or '', content)
+    text = html.unescape(text)
+    mailtos: List[str] = [unquote(html.unescape(m))
+                          for m in MAILTO.findall(content)]
+    if mailtos:
+        text += ' ' + ' '.join(mailtos)
+    return text
 
 
 def clean_urls(urls: List) -> List[str]:
@@ -75,4 +274,4 @@ def clean_urls(urls: List) -> List[str]:
         if url.split('.')[-1] in EXTENSIONS:
             continue
         tmp.append(url)
-    return list(set(tmp))
+    return list(dict.fromkeys(tmp))
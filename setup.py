@@ -15,8 +15,8 @@ setup(
     author_email="brandon@9bplus.com",
     license="MIT",
     packages=find_packages(),
-    install_requires=['beautifulsoup4', 'requests', 'requests-futures',
-                      'namesgenerator'],
+    install_requires=['beautifulsoup4', 'requests', 'namesgenerator'],
+    extras_require={'async': ['aiohttp']},
     long_description=read('README.rst'),
     classifiers=[
         'Development Status :: 4 - Beta',